@@ -1,23 +1,226 @@
 import streamlit as st
 import segno
+import io
 import os
+import tempfile
+import time
 from PIL import Image
+import metrics
+from artistic_qr import write_artistic_animation
+from deadline import Deadline
+from ingest import DEFAULT_LIMITS, IngestError, check_limits, probe
+from jobs import JobQueue, QueueFull
+from layer_cache import LayerCache
+from output_formats import get_format
+from result_cache import RENDERER_VERSION, ResultCache, cache_key
+from timing import DUPLICATE_THRESHOLD
 
-def create_artistic_qr(url, background_file, output_filename, scale=6):
-    try:
+# Renders running at once across all sessions, and how many more may wait
+RENDER_WORKERS = 2
+MAX_QUEUED_RENDERS = 8
+# Seconds between reruns while a render is in progress
+POLL_INTERVAL = 0.5
+# Segundos para cada renderização: o dyno derruba requisições após 30 s, então
+# uma renderização que não caberia é simplificada em vez de não entregar nada
+RENDER_TIME_BUDGET = 25
+
+# O que foi simplificado para caber no prazo, como mostrado na tela
+DEGRADATION_LABELS = {
+    "frame_rate": "menos quadros por segundo",
+    "scale": "resolução menor",
+    "resampling": "redimensionamento mais simples",
+    "truncated": "animação encurtada",
+}
+
+# Memória para frames decodificados e redimensionados, reaproveitados ao mudar escala ou cores
+LAYER_CACHE_BYTES = 256 * 1024 * 1024
+
+# Prévia: só os primeiros frames, em escala reduzida, renderizados na hora
+PREVIEW_SCALE = 3
+PREVIEW_FRAMES = 12
+
+# Formatos de saída oferecidos, com o nome mostrado na tela
+FORMAT_LABELS = {
+    "gif": "GIF",
+    "webp": "WebP (arquivo menor)",
+    "webp_lossless": "WebP sem perdas",
+    "apng": "APNG",
+}
+
+@st.cache_resource
+def get_result_cache():
+    # Shared by every session of this process; the disk tier survives restarts
+    return ResultCache(directory=os.path.join(tempfile.gettempdir(), "qrcode_animado_cache"))
+
+@st.cache_resource
+def get_layer_cache():
+    # Shared by every session: a new scale or colour for the same background skips decoding
+    return LayerCache(max_bytes=LAYER_CACHE_BYTES)
+
+@st.cache_resource
+def get_job_queue():
+    # One worker pool for the whole process, so concurrent sessions share the CPU budget
+    return JobQueue(workers=RENDER_WORKERS, max_queued=MAX_QUEUED_RENDERS)
+
+@st.cache_resource
+def init_metrics():
+    # QR_METRICS=1 liga a instrumentação; QR_METRICS_FILE / QR_METRICS_PORT exportam as métricas
+    return metrics.configure_from_env()
+
+@metrics.instrumented("artistic")
+def create_artistic_qr(url, background_file, scale=6, dark='black', light=None, progress=None, output_format="gif",
+                       deadline=None, layer_cache=None):
+    """
+    Render the QR code into an in-memory buffer; ``progress(done, total)`` is called per frame.
+
+    With a ``deadline.Deadline`` the render is degraded to finish within it,
+    and what was given up is listed in ``deadline.degradations``. Decoded
+    and resized frames are kept in ``layer_cache`` (a ``LayerCache``), if given.
+    """
+    with metrics.span("layout"):
+        qr = segno.make(url, error='h')
+    
+    output = io.BytesIO()
+    write_artistic_animation(
+        qr,
+        background_file,
+        output,
+        progress=progress,
+        output_format=output_format,
+        deadline=deadline,
+        duplicate_threshold=DUPLICATE_THRESHOLD,  # Frames quase iguais viram um só
+        limits=DEFAULT_LIMITS,  # Recusa GIFs grandes demais e reduz frames enormes ao decodificar
+        cache=layer_cache,
+        scale=scale,
+        dark=dark,
+        light=light
+    )
+    output.seek(0)
+    return output
+
+@st.cache_data(max_entries=32, show_spinner=False)
+@metrics.instrumented("artistic_preview")
+def create_preview(url, background, scale=PREVIEW_SCALE, dark='black', light=None):
+    """Low-resolution GIF bytes of the first ``PREVIEW_FRAMES`` frames, rendered in the session's own thread."""
+    with metrics.span("layout"):
         qr = segno.make(url, error='h')
+    output = io.BytesIO()
+    write_artistic_animation(
+        qr,
+        io.BytesIO(background),
+        output,
+        max_frames=PREVIEW_FRAMES,
+        duplicate_threshold=DUPLICATE_THRESHOLD,
+        limits=DEFAULT_LIMITS,
+        scale=scale,
+        dark=dark,
+        light=light
+    )
+    return output.getvalue()
+
+def render_to_cache(cache, key, url, background, scale=6, dark='black', light=None, output_format="gif",
+                    layer_cache=None, progress=None):
+    """
+    Job body: render from the background bytes within ``RENDER_TIME_BUDGET``.
+
+    Runs outside the script thread, so Streamlit resources such as
+    ``layer_cache`` are resolved by the caller. Returns (output,
+    degradations); only full renders are stored under ``key``.
+    """
+    deadline = Deadline(RENDER_TIME_BUDGET)
+    output = create_artistic_qr(url, io.BytesIO(background), scale, dark, light, progress, output_format, deadline,
+                                layer_cache)
+    if not deadline.degradations:
+        cache.put(key, output.getvalue())
+    return output, deadline.degradations
+
+def check_background(background):
+    """Whether the background bytes are within the ingest limits; shows the reason when they are not."""
+    try:
+        # Lê só o cabeçalho e a contagem de frames, antes de decodificar qualquer pixel
+        check_limits(probe(io.BytesIO(background), DEFAULT_LIMITS.max_bytes), DEFAULT_LIMITS)
+    except IngestError as e:
+        st.error(f"Não foi possível usar este GIF: {e}")
+        return False
+    return True
+
+def show_preview(url, uploaded_file):
+    """Show a quick low-resolution preview of the QR code over the uploaded background."""
+    background = uploaded_file.getvalue()
+    if not url or not check_background(background):
+        st.image(uploaded_file, caption="Fundo", use_container_width=True)
+        return
+    try:
+        preview = create_preview(url, background)
+    except Exception as e:
+        st.error(f"Error creating preview: {e}")
+        return
+    st.image(preview, caption="Prévia (baixa resolução)", use_container_width=True)
+
+def start_generation(url, uploaded_file, output_format="gif", scale=6, dark='black', light=None):
+    """Serve the QR code from the result cache, or queue a render job for it."""
+    background = uploaded_file.getvalue()
+    clear_generation()
+    if not check_background(background):
+        return
+    output_format = get_format(output_format)
+    key = cache_key(background, url, scale, dark, light, output_format, RENDERER_VERSION)
+    cache = get_result_cache()
+    data = cache.get(key)
+    st.session_state.qr_format = output_format
+    if data is not None:
+        st.session_state.qr_output = io.BytesIO(data)
+        return
+    try:
+        # Recursos do Streamlit só podem ser obtidos na thread do script, não na do job
+        job = get_job_queue().submit(render_to_cache, cache, key, url, background, scale, dark, light,
+                                     output_format, get_layer_cache())
+    except QueueFull:
+        st.warning("Muitos QR Codes sendo gerados agora. Tente novamente em instantes.")
+        return
+    st.session_state.qr_job = job.id
+
+def clear_generation():
+    """Forget this session's result when the inputs change; a running job still fills the cache."""
+    st.session_state.pop("qr_job", None)
+    st.session_state.pop("qr_output", None)
+    st.session_state.pop("qr_degradations", None)
+
+def show_generation():
+    """Show the progress of this session's render job, then its result."""
+    job_id = st.session_state.get("qr_job")
+    if job_id is not None:
+        job = get_job_queue().get(job_id)
+        if job is not None and not job.finished:
+            text = "Criando QR Code..." if job.status == "running" else "Aguardando na fila..."
+            st.progress(job.fraction, text=text)
+            time.sleep(POLL_INTERVAL)
+            st.rerun()
+        del st.session_state.qr_job
+        if job is None:
+            return
+        if job.error is not None:
+            st.error(f"Error creating QR code: {job.error}")
+            return
+        st.session_state.qr_output, st.session_state.qr_degradations = job.result
+    
+    output = st.session_state.get("qr_output")
+    if output is not None:
+        st.success("QR Code gerado com sucesso!")
+        degradations = st.session_state.get("qr_degradations")
+        if degradations:
+            steps = ", ".join(DEGRADATION_LABELS.get(step, step) for step, _ in degradations)
+            st.info(f"Para ficar pronto a tempo, o QR Code foi simplificado: {steps}.")
+        st.image(output, caption="QR Code Gerado")
         
-        qr.to_artistic(
-            background=background_file,
-            target=output_filename,
-            scale=scale,
-            dark='black',
-            light=None
+        # Styled download button, fed from the same buffer, with the type of the chosen format
+        output_format = st.session_state.get("qr_format", get_format("gif"))
+        st.download_button(
+            label="⬇️ Baixar QR Code",
+            data=output,
+            file_name=f"qr_code{output_format.extension}",
+            mime=output_format.mime
         )
-        return True
-    except Exception as e:
-        st.error(f"Error creating QR code: {e}")
-        return False
 
 def main():
     # Configure page layout
@@ -26,6 +229,7 @@ def main():
         page_icon="🔗",
         layout="centered"
     )
+    init_metrics()
     # Custom CSS - add these styles
     st.markdown("""
         <style>
@@ -121,36 +325,37 @@ def main():
     
     # URL input with better styling
     url = st.text_input("URL:", "https://www.sicredi.com.br", 
-                       help="Digite a URL para seu QR code")
+                       help="Digite a URL para seu QR code",
+                       on_change=clear_generation)
     
     # File uploader with instructions
     uploaded_file = st.file_uploader("Escolha um arquivo GIF", 
                                    type=['gif'],
-                                   help="Faça upload de um GIF animado para usar como fundo")
+                                   help="Faça upload de um GIF animado para usar como fundo",
+                                   on_change=clear_generation)
+    
+    # Formato do arquivo gerado; WebP fica bem menor que GIF e não limita a 256 cores
+    format_name = st.selectbox("Formato:", list(FORMAT_LABELS), format_func=FORMAT_LABELS.get,
+                               on_change=clear_generation)
+    quality = method = None
+    if format_name == "webp":
+        quality = st.slider("Qualidade:", 50, 100, 80, on_change=clear_generation)
+    if format_name in ("webp", "webp_lossless"):
+        # Esforço do codificador WebP: 0 gera mais rápido, 6 gera o arquivo menor
+        method = st.slider("Compressão (velocidade × tamanho):", 0, 6, get_format(format_name).method,
+                           on_change=clear_generation)
+    output_format = get_format(format_name, quality=quality, method=method)
     
     if uploaded_file is not None:
         cols = st.columns(2)
         with cols[0]:
-            st.image(uploaded_file, caption="Prévia", use_container_width=True)
+            # Prévia rápida a cada mudança; a versão completa só é gerada ao confirmar
+            show_preview(url, uploaded_file)
         
         with cols[1]:
             if st.button("Gerar QR Code", type="primary"):
-                with st.spinner("Criando QR Code..."):
-                    output_path = "generated_qr.gif"
-                    success = create_artistic_qr(url, uploaded_file, output_path)
-                    
-                    if success:
-                        st.success("QR Code gerado com sucesso!")
-                        st.image(output_path, caption="QR Code Gerado")
-                        
-                        # Styled download button
-                        with open(output_path, "rb") as file:
-                            st.download_button(
-                                label="⬇️ Baixar QR Code",
-                                data=file,
-                                file_name="qr_code.gif",
-                                mime="image/gif"
-                            )
-                            # Remove the duplicate download button that was here
+                # Full render, in memory on a shared worker pool; nothing is shared on disk between sessions
+                start_generation(url, uploaded_file, output_format)
+            show_generation()
 if __name__ == "__main__":
     main()
\ No newline at end of file
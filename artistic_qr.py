@@ -0,0 +1,263 @@
+import math
+from functools import partial
+from itertools import islice
+import numpy as np
+from PIL import Image, ImageSequence
+from qrcode_artistic import write_pil
+from segno import consts
+import metrics
+from deadline import CostModel, RenderPlan, estimate
+from output_formats import get_format, open_writer
+from ingest import open_background, shrink_frame
+from layer_cache import background_key, decoded_frames, fits_decoded
+from timing import DEFAULT_DURATION, retime_frames
+
+try:
+    from PIL.Image import Resampling
+    LANCZOS = Resampling.LANCZOS
+except ImportError:
+    from PIL.Image import LANCZOS
+
+# Estimated cost of a frame, for renders with a deadline; see ``deadline.CostModel``
+RENDER_COST = CostModel(frame=0.010, source_pixel=33e-9, output_pixel=185e-9)
+
+# Modules drawn in QR colours only; the background never shows through them
+KEEP_MODULES = (
+    consts.TYPE_FINDER_PATTERN_DARK, consts.TYPE_FINDER_PATTERN_LIGHT, consts.TYPE_SEPARATOR,
+    consts.TYPE_ALIGNMENT_PATTERN_DARK, consts.TYPE_ALIGNMENT_PATTERN_LIGHT, consts.TYPE_TIMING_DARK,
+    consts.TYPE_TIMING_LIGHT,
+)
+
+
+class ArtisticLayout:
+    """
+    Per-job geometry of ``segno``'s ``to_artistic`` for one QR code and background size.
+
+    Reproduces ``qrcode_artistic.write_artistic`` frame by frame: the QR
+    image, the size and position of the resized background and the mask of
+    pixels where the background replaces the QR code are computed once,
+    and ``render`` then composites a frame with a single NumPy assignment
+    instead of one ``getpixel``/``point`` call per pixel.
+
+    Args:
+        qr: a ``segno.QRCode``
+        background_size: (width, height) of the background frames
+        scale: requested module size, as for ``to_artistic``
+        border: quiet zone in modules, None for the default
+        dark, light, **colors: module colours, as for ``to_artistic``
+        resample: filter of the frame and output resizes; Lanczos, as
+            ``to_artistic``, unless a render is degraded to meet a deadline
+    """
+
+    def __init__(self, qr, background_size, scale=3, border=None, dark='#000', light='#fff', resample=LANCZOS,
+                 **colors):
+        self.resample = resample
+        self.requested_scale = int(scale)
+        scale = self.requested_scale
+        while scale % 3:
+            scale += 1
+        self.scale = scale
+        qr_img = write_pil(qr, scale=scale, border=border, dark=dark, light=light, **colors).convert('RGBA')
+        self.qr_array = np.asarray(qr_img)
+
+        # The background is not drawn over the quiet zone
+        self.bg_box = qr.symbol_size(scale=scale, border=0)
+        max_width, max_height = self.bg_box
+        bg_width, bg_height = background_size
+        ratio = min(max_width / bg_width, max_height / bg_height)
+        self.bg_size = (int(bg_width * ratio), int(bg_height * ratio))
+        self.bg_pos = (int(math.ceil((max_width - self.bg_size[0]) / 2)),
+                       int(math.ceil((max_height - self.bg_size[1]) / 2)))
+        border = border if border is not None else qr.default_border_size
+        self.offset = border * scale
+
+        # write_artistic reads and draws pixel (i, j) for matrix row i, column j,
+        # so the module mask is transposed into image (y, x) order
+        types = np.array(list(qr.matrix_iter(scale=scale, border=0, verbose=True)))
+        centre = (np.arange(max(types.shape)) // (scale // 3)) % 3 == 1
+        keep = np.isin(types, KEEP_MODULES) | (centre[:types.shape[0], None] & centre[None, :types.shape[1]])
+        self.mask = ~keep.T
+
+        self.output_size = None
+        if scale != self.requested_scale:
+            out_width, out_height = qr.symbol_size(scale=self.requested_scale, border=border)
+            ratio = min(out_width / max_width, out_height / max_height)
+            self.output_size = (int(max_width * ratio), int(max_height * ratio))
+
+    def render(self, frame, mode=None):
+        """Composite one background frame; returns an RGBA image, or ``mode`` if given."""
+        with metrics.span("resize"):
+            bg = Image.new('RGBA', self.bg_box, (255, 0, 0, 0))
+            bg.paste(frame.resize(self.bg_size, self.resample), self.bg_pos)
+        with metrics.span("composite"):
+            bg = np.asarray(bg)
+            result = self.qr_array.copy()
+            height, width = self.mask.shape
+            region = result[self.offset:self.offset + height, self.offset:self.offset + width]
+            show = self.mask & (bg[..., 3] > 0)
+            region[show] = bg[show]
+            image = Image.fromarray(result, 'RGBA')
+        with metrics.span("resize"):
+            if self.output_size is not None:
+                image = image.resize(self.output_size, self.resample)
+        with metrics.span("convert"):
+            if mode is not None and mode != 'RGBA':
+                image = image.convert(mode)
+        return image
+
+
+def _artistic_key(qr, background_size, kwargs):
+    # The module types ArtisticLayout reads depend on the symbol, its mask and the matrix
+    matrix = b"".join(bytes(row) for row in qr.matrix)
+    return (qr.designator, qr.mask, matrix, background_size, tuple(sorted(kwargs.items())))
+
+
+def _resized_frames(decoded, size, duplicate_threshold, max_fps, shrink, resample):
+    # The source frames of the streaming path, kept: shrunk, retimed, then resized as ``render`` resizes them
+    timed = ((shrink_frame(frame, size) if shrink else frame, duration)
+             for frame, duration in zip(decoded.frames, decoded.durations))
+    return [(frame.resize(size, resample), duration)
+            for frame, duration in retime_frames(timed, duplicate_threshold, max_fps)]
+
+
+def iter_artistic_frames(qr, background, progress=None, duplicate_threshold=0, max_fps=None, limits=None,
+                         source_mode=True, max_frames=None, cache=None, **kwargs):
+    """
+    Render an artistic QR code one background frame at a time.
+
+    With the default arguments the animation is identical to
+    ``qr.to_artistic(background, ...)`` saved as a GIF (repeated source
+    frames are rendered once, with their summed duration); rendering frame
+    by frame lets callers stream the result and report progress.
+
+    Args:
+        qr: a ``segno.QRCode``
+        background: path or file object of the background image
+        progress: optional callable(done, total) called after every rendered
+            frame, counting the source frames consumed so far
+        duplicate_threshold: fold source frames this close to the previous
+            one into it (see ``timing.retime_frames``), None to render all
+        max_fps: optional frame rate cap
+        limits: optional ``ingest.IngestLimits`` checked before decoding;
+            with limits, frames much larger than the code are also shrunk
+            as they load (see ``ingest.shrink_frame``)
+        source_mode: convert frames to the background's mode, as
+            ``to_artistic`` does; False yields RGBA frames
+        max_frames: render only this many leading source frames (for
+            previews), None for all
+        cache: a ``layer_cache.LayerCache`` keeping the decoded and resized
+            frames and the layout, so a new scale or colour for the same
+            background skips decoding; not used with ``max_frames``
+        **kwargs: ``to_artistic`` options (scale, border, dark, light, ...)
+
+    Raises:
+        ingest.IngestError: when the background is over ``limits``
+
+    Yields:
+        (frame, duration in milliseconds) pairs
+    """
+    with open_background(background, limits) as bg:
+        input_mode = bg.mode
+        if cache is not None and max_frames is None and fits_decoded(cache, bg):
+            source = background_key(background)
+            with metrics.span("decode"):
+                decoded = decoded_frames(cache, source, bg)
+            with metrics.span("layout"):
+                layout = cache.get("overlay", _artistic_key(qr, bg.size, kwargs),
+                                   lambda: ArtisticLayout(qr, bg.size, **kwargs))
+            key = (source, layout.bg_size, duplicate_threshold, max_fps, limits is not None, layout.resample)
+            frames = cache.get("resized", key, lambda: _resized_frames(decoded, layout.bg_size, duplicate_threshold,
+                                                                       max_fps, limits is not None, layout.resample))
+            for done, (frame, duration) in enumerate(frames, 1):
+                yield layout.render(frame, input_mode if source_mode else None), duration
+                if progress is not None:
+                    progress(done, len(frames))
+            return
+
+        total = getattr(bg, "n_frames", 1)
+        if max_frames is not None:
+            total = min(total, max_frames)
+        with metrics.span("layout"):
+            layout = ArtisticLayout(qr, bg.size, **kwargs)
+        consumed = 0
+
+        def source_frames():
+            nonlocal consumed
+            for frame in islice(ImageSequence.Iterator(bg), max_frames):
+                consumed += 1
+                copy = frame.copy() if limits is None else shrink_frame(frame, layout.bg_size)
+                yield copy, frame.info.get("duration", 0)
+
+        timed = metrics.timed_iter(source_frames(), "decode")
+        for frame, duration in retime_frames(timed, duplicate_threshold, max_fps):
+            yield layout.render(frame, input_mode if source_mode else None), duration
+            if progress is not None:
+                progress(consumed, total)
+
+
+def plan_artistic(deadline, qr, image, kwargs):
+    """
+    ``kwargs`` of ``iter_artistic_frames`` with the frame rate, scale and filter degraded to meet ``deadline``.
+
+    Only multiples of 3 are tried as lower scales: others are rendered at
+    the next multiple of 3 and resized, which costs more, not less.
+    """
+    border = kwargs.get("border")
+    requested = RenderPlan(kwargs.get("max_fps"), int(kwargs.get("scale", 3)), kwargs.get("resample", LANCZOS))
+
+    def output_pixels(scale):
+        width, height = qr.symbol_size(scale=3 * math.ceil(scale / 3), border=border)
+        return width * height
+
+    cost_of = partial(estimate, RENDER_COST, frame_count=getattr(image, "n_frames", 1),
+                      frame_duration=image.info.get("duration") or DEFAULT_DURATION,
+                      source_pixels=image.width * image.height, output_pixels=output_pixels)
+    scales = [scale for scale in range(3 * (requested.scale // 3), 2, -3) if scale < requested.scale]
+    plan = deadline.plan(requested, cost_of, scales)
+    return dict(kwargs, max_fps=plan.max_fps, scale=plan.scale, resample=plan.resample)
+
+
+def write_artistic_gif(qr, background, target, progress=None, **kwargs):
+    """
+    Stream an animated artistic QR code into ``target`` (filename or binary file object).
+
+    See ``iter_artistic_frames`` for the arguments.
+    """
+    write_artistic_animation(qr, background, target, progress, **kwargs)
+
+
+def write_artistic_animation(qr, background, target, progress=None, output_format="gif", deadline=None,
+                             workers=1, **kwargs):
+    """
+    Write an animated artistic QR code into ``target`` as GIF, WebP or APNG.
+
+    GIF frames keep the background's mode, as ``to_artistic`` writes them;
+    the other formats get full colour RGBA frames.
+
+    Args:
+        output_format: an ``output_formats.OutputFormat`` or a name from ``output_formats.FORMATS``
+        deadline: a ``deadline.Deadline``; the render is degraded to finish
+            within it (see ``plan_artistic``) and stops early if it still
+            runs late, recording what was given up on the deadline
+        workers: number of worker processes encoding GIF frames (see ``gif_writer.GifWriter``)
+
+    See ``iter_artistic_frames`` for the other arguments.
+
+    Raises:
+        ingest.IngestError: when the background is over ``limits``
+    """
+    output_format = get_format(output_format)
+    # Check the limits before the header is read for planning, not only once the frames are decoded
+    with open_background(background, kwargs.get("limits")) as image:
+        loop = image.info.get("loop", 0)
+        if deadline is not None:
+            kwargs = plan_artistic(deadline, qr, image, kwargs)
+    if hasattr(background, "seek"):
+        background.seek(0)
+    source_mode = output_format.pillow_format == "GIF"
+    frames = iter_artistic_frames(qr, background, progress, source_mode=source_mode, **kwargs)
+    if deadline is not None:
+        frames = deadline.frames(frames)
+    with open_writer(target, output_format, loop=loop, workers=workers) as writer:
+        for frame, duration in frames:
+            writer.write(frame, duration)
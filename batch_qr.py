@@ -0,0 +1,235 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import segno
+import basic_qr
+import pil_qr_creator
+import working_qr
+from artistic_qr import write_artistic_animation
+from frame_pool import resolve_workers
+from ingest import DEFAULT_LIMITS, check_limits, probe
+from layer_cache import LayerCache
+from qr_style import render_styled_gif
+from timing import DUPLICATE_THRESHOLD
+
+# Overlay styles and the layout function of their renderer; "artistic" is segno's to_artistic look
+LAYOUTS = {
+    "styled": working_qr.styled_layout,
+    "pil": pil_qr_creator.styled_layout,
+    "basic": basic_qr.basic_layout,
+}
+STYLES = tuple(LAYOUTS) + ("artistic",)
+
+BatchEntry = namedtuple("BatchEntry", "url output")
+BatchResult = namedtuple("BatchResult", "url output ok seconds error")
+
+
+def read_manifest(path):
+    """
+    Read the codes of a batch from a CSV or JSONL manifest.
+
+    CSV files have a ``url`` and an optional ``output`` column; without a
+    header row the first two columns are used. JSONL files hold one
+    ``{"url": ..., "output": ...}`` object per line. Entries without an
+    output get ``qr_0001.gif``, ``qr_0002.gif``, ... by position.
+
+    Returns:
+        list of ``BatchEntry``
+    """
+    entries = []
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.lower().endswith((".jsonl", ".ndjson")):
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    entries.append(BatchEntry(record["url"], record.get("output")))
+        else:
+            rows = [row for row in csv.reader(f) if row and any(cell.strip() for cell in row)]
+            url_column, output_column = 0, 1
+            if rows:
+                header = [cell.strip().lower() for cell in rows[0]]
+                if "url" in header:
+                    url_column = header.index("url")
+                    output_column = header.index("output") if "output" in header else None
+                    rows = rows[1:]
+            for row in rows:
+                output = row[output_column].strip() if output_column is not None and len(row) > output_column else ""
+                entries.append(BatchEntry(row[url_column].strip(), output or None))
+    return [
+        entry if entry.output else entry._replace(output=f"qr_{index:04d}.gif")
+        for index, entry in enumerate(entries, 1)
+    ]
+
+
+class BatchBackground:
+    """
+    A background animation shared by every code of a batch.
+
+    The background is checked against the ingest limits once, when the
+    object is created. Codes are rendered by the single-code renderers
+    with one ``LayerCache``, so the background is decoded once, and the
+    frames resized for a code (with their palette and palette indices for
+    the overlay styles) are reused by every later code of that size (codes
+    of the same QR version share one). Backgrounds too large for the cache
+    are streamed, their frames shrunk as they load (see ``ingest.shrink_frame``).
+
+    Args:
+        path: the background image
+        duplicate_threshold, max_fps: see ``timing.retime_frames``
+        max_cache_bytes: memory for decoded and resized frames, across sizes
+        limits: ``ingest.IngestLimits`` checked before decoding, None for no limits
+
+    Raises:
+        ingest.IngestError: when the background is over ``limits``
+    """
+
+    def __init__(self, path, duplicate_threshold=DUPLICATE_THRESHOLD, max_fps=None,
+                 max_cache_bytes=256 * 1024 * 1024, limits=DEFAULT_LIMITS):
+        if limits is not None:
+            check_limits(probe(path, limits.max_bytes), limits)
+        self.path = path
+        self.duplicate_threshold = duplicate_threshold
+        self.max_fps = max_fps
+        self.limits = limits
+        self.cache = LayerCache(max_bytes=max_cache_bytes)
+
+
+def render_code(background, style, url, output, **options):
+    """
+    Render one code of a batch over a ``BatchBackground`` into ``output``.
+
+    Args:
+        background: the shared ``BatchBackground``
+        style: one of ``STYLES``
+        url: content of the QR code
+        output: filename or binary file object
+        **options: options of the style's layout (opacity, scale, dark, light, ...)
+    """
+    shared = dict(duplicate_threshold=background.duplicate_threshold, max_fps=background.max_fps,
+                  limits=background.limits, cache=background.cache)
+    if style == "artistic":
+        write_artistic_animation(segno.make(url, error='h'), background.path, output, **shared, **options)
+    elif style in LAYOUTS:
+        render_styled_gif(LAYOUTS[style](url, **options), output, background.path, **shared)
+    else:
+        raise ValueError(f"Unknown style {style!r}, expected one of {', '.join(STYLES)}")
+
+
+_background = None
+
+
+def _init_worker(background_path, duplicate_threshold, max_fps):
+    # Each worker process decodes the background once, for all the codes it renders
+    global _background
+    _background = BatchBackground(background_path, duplicate_threshold, max_fps)
+
+
+def _render_entry(style, url, output, options):
+    start = time.perf_counter()
+    try:
+        directory = os.path.dirname(output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        render_code(_background, style, url, output, **options)
+    except Exception as e:
+        return BatchResult(url, output, False, time.perf_counter() - start, str(e))
+    return BatchResult(url, output, True, time.perf_counter() - start, None)
+
+
+def run_batch(background_path, entries, style="styled", output_dir=".", workers=1,
+              duplicate_threshold=DUPLICATE_THRESHOLD, max_fps=None, progress=None, **options):
+    """
+    Render many QR codes over one background.
+
+    The background is checked once, and decoded once per worker process
+    (see ``BatchBackground``); resized frames are shared by all codes of
+    the same size, so each code only costs its overlay, compositing and
+    GIF encoding. Entries are
+    spread over ``workers`` processes; a failing entry is reported in its
+    result and does not stop the batch.
+
+    Args:
+        background_path: the background image
+        entries: iterable of ``BatchEntry`` (see ``read_manifest``)
+        style: one of ``STYLES``
+        output_dir: directory the entry outputs are relative to
+        workers: number of worker processes; 1 renders in this process,
+            ``None`` or ``0`` uses every core
+        duplicate_threshold, max_fps: see ``timing.retime_frames``
+        progress: optional callable(done, total, result) called as entries finish
+        **options: options of the style (see ``render_code``)
+
+    Returns:
+        list of ``BatchResult``, in entry order
+    """
+    if style not in STYLES:
+        raise ValueError(f"Unknown style {style!r}, expected one of {', '.join(STYLES)}")
+    jobs = [(style, entry.url, os.path.join(output_dir, entry.output), options) for entry in entries]
+    results = [None] * len(jobs)
+    workers = min(resolve_workers(workers), max(len(jobs), 1))
+    if workers == 1:
+        _init_worker(background_path, duplicate_threshold, max_fps)
+        for index, job in enumerate(jobs):
+            results[index] = _render_entry(*job)
+            if progress is not None:
+                progress(index + 1, len(jobs), results[index])
+        return results
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(background_path, duplicate_threshold, max_fps)) as pool:
+        futures = {pool.submit(_render_entry, *job): index for index, job in enumerate(jobs)}
+        for done, future in enumerate(as_completed(futures), 1):
+            index = futures[future]
+            results[index] = future.result()
+            if progress is not None:
+                progress(done, len(jobs), results[index])
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render many animated QR codes over one background.")
+    parser.add_argument("background", help="background GIF shared by every code")
+    parser.add_argument("manifest", help="CSV (url,output) or JSONL manifest of the codes")
+    parser.add_argument("--style", choices=STYLES, default="styled")
+    parser.add_argument("--output-dir", default=".", help="directory for the generated GIFs")
+    parser.add_argument("--workers", type=int, default=0, help="worker processes, 0 for one per core")
+    parser.add_argument("--scale", type=int, help="module size for the basic and artistic styles")
+    parser.add_argument("--opacity", type=int, default=255, help="opacity of the data modules (styled)")
+    parser.add_argument("--dark", default="black", help="dark module colour (artistic)")
+    parser.add_argument("--light", default=None, help="light module colour (artistic)")
+    parser.add_argument("--duplicate-threshold", type=int, default=DUPLICATE_THRESHOLD)
+    parser.add_argument("--max-fps", type=float, default=None)
+    args = parser.parse_args(argv)
+
+    if args.style == "styled":
+        options = {"opacity": args.opacity}
+    elif args.style == "basic":
+        options = {"scale": args.scale or 30}
+    elif args.style == "artistic":
+        options = {"scale": args.scale or 6, "dark": args.dark, "light": args.light}
+    else:
+        options = {}
+
+    entries = read_manifest(args.manifest)
+    print(f"Rendering {len(entries)} QR codes over {args.background}")
+
+    def report(done, total, result):
+        status = f"{result.seconds:.2f}s" if result.ok else f"ERROR: {result.error}"
+        print(f"[{done}/{total}] {result.output} ({status})")
+
+    start = time.perf_counter()
+    results = run_batch(args.background, entries, args.style, args.output_dir, args.workers,
+                        args.duplicate_threshold, args.max_fps, progress=report, **options)
+    elapsed = time.perf_counter() - start
+    failed = [result for result in results if not result.ok]
+    print(f"Rendered {len(results) - len(failed)}/{len(results)} QR codes in {elapsed:.1f}s")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
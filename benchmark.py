@@ -0,0 +1,293 @@
+import argparse
+import contextlib
+import functools
+import io
+import itertools
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from collections import defaultdict, namedtuple
+import numpy as np
+import PIL
+import qrcode_artistic
+import segno
+from PIL import Image, ImageDraw
+import artistic_qr
+import basic_qr
+import gif_writer
+import output_formats
+import pil_qr_creator
+import qr_style
+import timing
+import working_qr
+
+# A renderer under test: run(url, output, background, scale, error) and the sweep parameters it honours
+Renderer = namedtuple("Renderer", "run params")
+
+
+def _run_basic(url, output, background, scale, error):
+    return basic_qr.create_basic_qr(url, output, background, scale=scale)
+
+
+def _run_styled(url, output, background, scale, error):
+    return working_qr.create_styled_qr(url, output, background)
+
+
+def _run_pil_styled(url, output, background, scale, error):
+    return pil_qr_creator.create_styled_qr(url, output, background)
+
+
+def _run_pil_static(url, output, background, scale, error):
+    return pil_qr_creator.create_qr_with_pil(url, output, background, scale=scale)
+
+
+def _run_artistic(url, output, background, scale, error):
+    # The app's path: streamed NumPy reimplementation of to_artistic
+    qr = segno.make(url, error=error)
+    artistic_qr.write_artistic_gif(qr, background, output, scale=scale, dark='black', light=None)
+    return True
+
+
+def _run_to_artistic(url, output, background, scale, error):
+    # segno's own to_artistic, as used by test_artistic.py and test_small_qr.py
+    qr = segno.make(url, error=error)
+    qr.to_artistic(background=background, target=output, scale=scale, kind='gif', dark='black', light=None)
+    return True
+
+
+RENDERERS = {
+    "basic": Renderer(_run_basic, ("scale",)),
+    "styled": Renderer(_run_styled, ()),
+    "pil_styled": Renderer(_run_pil_styled, ()),
+    "pil_static": Renderer(_run_pil_static, ("scale",)),
+    "artistic": Renderer(_run_artistic, ("scale", "error")),
+    "to_artistic": Renderer(_run_to_artistic, ("scale", "error")),
+}
+
+# Functions timed for the stage breakdown; time spent elsewhere (decoding, I/O) is reported as "other"
+STAGE_HOOKS = {
+    "layout": [(qr_style, "style_layout"), (artistic_qr.ArtisticLayout, "__init__")],
+    "palette": [(qr_style, "build_palette")],
+    "dedupe": [(timing, "frames_match")],
+    "compose": [(qr_style.BatchCompositor, "__call__"), (artistic_qr.ArtisticLayout, "render")],
+    "encode": [(gif_writer.GifWriter, "write"), (gif_writer.GifWriter, "close"), (output_formats.AnimationWriter, "close")],
+}
+
+
+@contextlib.contextmanager
+def stage_timers(totals):
+    """Time every ``STAGE_HOOKS`` function into ``totals`` (stage -> seconds) while active."""
+    def timed(func, stage):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                totals[stage] += time.perf_counter() - start
+        return wrapper
+
+    patched = []
+    try:
+        for stage, hooks in STAGE_HOOKS.items():
+            for owner, name in hooks:
+                original = getattr(owner, name)
+                patched.append((owner, name, original))
+                setattr(owner, name, timed(original, stage))
+        yield totals
+    finally:
+        for owner, name, original in reversed(patched):
+            setattr(owner, name, original)
+
+
+def synthetic_background(path, frame_count, size, seed=0):
+    """
+    Write a synthetic animated GIF background.
+
+    Every frame is a drifting colour gradient with a few moving shapes, so
+    frames differ from each other (nothing is deduplicated) and compress
+    like real footage rather than flat colour.
+    """
+    width, height = size
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    shapes = rng.uniform(0, 1, size=(4, 5))  # x, y, radius, speed, hue
+    frames = []
+    for index in range(frame_count):
+        phase = 2 * np.pi * index / max(frame_count, 1)
+        red = 127 + 120 * np.sin(2 * np.pi * x / width + phase)
+        green = 127 + 120 * np.sin(2 * np.pi * y / height - phase)
+        blue = 127 + 120 * np.sin(2 * np.pi * (x + y) / (width + height) + 2 * phase)
+        frame = Image.fromarray(np.dstack([red, green, blue]).astype(np.uint8), "RGB")
+        draw = ImageDraw.Draw(frame)
+        for cx, cy, radius, speed, hue in shapes:
+            cx = (cx + speed * index / max(frame_count, 1)) % 1 * width
+            radius = (0.05 + 0.1 * radius) * min(width, height)
+            color = tuple(int(255 * c) for c in (hue, 1 - hue, (hue * 3) % 1))
+            draw.ellipse([cx - radius, cy * height - radius, cx + radius, cy * height + radius], fill=color)
+        frames.append(frame)
+    frames[0].save(path, save_all=True, append_images=frames[1:], duration=50, loop=0)
+    return path
+
+
+def make_url(length):
+    """A deterministic URL of exactly ``length`` characters (at least the base URL)."""
+    base = "https://example.com/"
+    return base + "".join(itertools.islice(itertools.cycle("abcdefghij0123456789"), max(0, length - len(base))))
+
+
+def run_job(renderer, url, background, scale, error, output):
+    """Run one render; returns (wall seconds, stage seconds, error message or None)."""
+    totals = defaultdict(float)
+    start = time.perf_counter()
+    failure = None
+    try:
+        with stage_timers(totals), contextlib.redirect_stdout(io.StringIO()) as log:
+            ok = RENDERERS[renderer].run(url, output, background, scale, error)
+        if ok is False:
+            failure = log.getvalue().strip().splitlines()[-1] if log.getvalue().strip() else "renderer returned False"
+    except Exception as e:
+        failure = f"{type(e).__name__}: {e}"
+    wall = time.perf_counter() - start
+    stages = {stage: round(totals[stage], 6) for stage in STAGE_HOOKS}
+    stages["other"] = round(max(0.0, wall - sum(totals.values())), 6)
+    return wall, stages, failure
+
+
+def sweep(renderers, backgrounds, scales, url_lengths, errors):
+    """Yield (renderer, background, scale, url_length, error) jobs, without repeating parameters a renderer ignores."""
+    seen = set()
+    for renderer, background, scale, url_length, error in itertools.product(
+            renderers, backgrounds, scales, url_lengths, errors):
+        params = RENDERERS[renderer].params
+        key = (renderer, background, scale if "scale" in params else None, url_length,
+               error if "error" in params else None)
+        if key in seen:
+            continue
+        seen.add(key)
+        yield key
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "pillow": PIL.__version__,
+        "numpy": np.__version__,
+        "segno": segno.__version__,
+        "qrcode_artistic": qrcode_artistic.__version__,
+    }
+
+
+def run_benchmark(renderers, frame_counts, sizes, scales, url_lengths, errors, repeat=3, workdir=None,
+                  progress=None):
+    """
+    Run the benchmark sweep and return the report as a dict.
+
+    Each job is run ``repeat`` times; the run with the median wall time is
+    reported. ``fps`` counts background frames processed per second.
+    Parameters a renderer ignores (fixed error level or scale) appear as
+    null and are not swept.
+
+    Args:
+        renderers: names from ``RENDERERS``
+        frame_counts, sizes: synthetic backgrounds, one per (frame count, (width, height))
+        scales, url_lengths, errors: sweep values
+        repeat: runs per job
+        workdir: directory for backgrounds and outputs, a temporary one if None
+        progress: optional callable(done, total, result)
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = workdir or tmp
+        os.makedirs(workdir, exist_ok=True)
+        backgrounds = {}
+        for frame_count, size in itertools.product(frame_counts, sizes):
+            path = os.path.join(workdir, f"bg_{frame_count}f_{size[0]}x{size[1]}.gif")
+            backgrounds[path] = {"frames": frame_count, "width": size[0], "height": size[1]}
+            synthetic_background(path, frame_count, size)
+
+        jobs = list(sweep(renderers, list(backgrounds), scales, url_lengths, errors))
+        results = []
+        for done, (renderer, background, scale, url_length, error) in enumerate(jobs, 1):
+            url = make_url(url_length)
+            output = os.path.join(workdir, f"out_{renderer}.gif")
+            runs = [run_job(renderer, url, background, scale or scales[0], error or errors[0], output)
+                    for _ in range(repeat)]
+            wall, stages, failure = sorted(runs, key=lambda run: run[0])[len(runs) // 2]
+            result = {
+                "renderer": renderer,
+                "background": backgrounds[background],
+                "scale": scale,
+                "url_length": url_length,
+                "error": error,
+                "wall_time": round(wall, 6),
+                "wall_times": [round(run[0], 6) for run in runs],
+                "fps": round(backgrounds[background]["frames"] / wall, 3) if wall else None,
+                "stages": stages,
+                "error_message": failure,
+            }
+            if failure is None and os.path.exists(output):
+                result["output_bytes"] = os.path.getsize(output)
+                with Image.open(output) as image:
+                    result["output_frames"] = getattr(image, "n_frames", 1)
+                os.remove(output)
+            results.append(result)
+            if progress is not None:
+                progress(done, len(jobs), result)
+
+    return {
+        "environment": environment(),
+        "config": {
+            "renderers": list(renderers), "frame_counts": list(frame_counts),
+            "sizes": [list(size) for size in sizes], "scales": list(scales),
+            "url_lengths": list(url_lengths), "errors": list(errors), "repeat": repeat,
+        },
+        "results": results,
+    }
+
+
+def _size(text):
+    width, _, height = text.lower().partition("x")
+    return int(width), int(height or width)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the QR renderers on synthetic backgrounds.")
+    parser.add_argument("--renderers", nargs="+", choices=list(RENDERERS), default=list(RENDERERS))
+    parser.add_argument("--frames", nargs="+", type=int, default=[10, 40], help="background frame counts")
+    parser.add_argument("--sizes", nargs="+", type=_size, default=[(200, 200), (480, 480)],
+                        help="background sizes, as WIDTHxHEIGHT")
+    parser.add_argument("--scales", nargs="+", type=int, default=[4, 8])
+    parser.add_argument("--url-lengths", nargs="+", type=int, default=[30, 120])
+    parser.add_argument("--errors", nargs="+", choices=["l", "m", "q", "h"], default=["m", "h"])
+    parser.add_argument("--repeat", type=int, default=3, help="runs per job; the median is reported")
+    parser.add_argument("--quick", action="store_true", help="one small background, one value per parameter")
+    parser.add_argument("--output", default="benchmark.json", help="JSON report path")
+    args = parser.parse_args(argv)
+
+    if args.quick:
+        args.frames, args.sizes, args.scales = [10], [(200, 200)], [4]
+        args.url_lengths, args.errors, args.repeat = [40], ["h"], 1
+
+    def report(done, total, result):
+        status = result["error_message"] or f"{result['fps']} fps, {result.get('output_bytes')} bytes"
+        print(f"[{done}/{total}] {result['renderer']} {result['background']['frames']}f "
+              f"{result['background']['width']}x{result['background']['height']} "
+              f"scale={result['scale']} url={result['url_length']} error={result['error']}: "
+              f"{result['wall_time']:.3f}s ({status})")
+
+    report_data = run_benchmark(args.renderers, args.frames, args.sizes, args.scales, args.url_lengths,
+                                args.errors, args.repeat, progress=report)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report_data, f, indent=2)
+    print(f"Report saved as {args.output}")
+    failed = [result for result in report_data["results"] if result["error_message"]]
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
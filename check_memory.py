@@ -0,0 +1,247 @@
+import argparse
+import itertools
+import json
+import os
+import resource
+import sys
+import tempfile
+import tracemalloc
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+import benchmark
+from qr_style import BATCH_FRAMES
+
+# Memory a renderer may use: ``absolute`` is the most a single run of the
+# sweep may add to the process peak RSS, in MB, and ``per_frame`` the most
+# each extra background frame may add, in KB.
+MemoryBudget = namedtuple("MemoryBudget", "absolute per_frame")
+
+# Streaming renderers hold a batch of frames whatever the length of the
+# background; segno's to_artistic keeps every composited frame until it
+# saves, so it is only held to its current growth.
+BUDGETS = {
+    "basic": MemoryBudget(absolute=80, per_frame=256),
+    "styled": MemoryBudget(absolute=80, per_frame=256),
+    "pil_styled": MemoryBudget(absolute=80, per_frame=256),
+    "pil_static": MemoryBudget(absolute=20, per_frame=64),
+    "artistic": MemoryBudget(absolute=40, per_frame=256),
+    "to_artistic": MemoryBudget(absolute=200, per_frame=2048),
+}
+
+# Peak memory that grows by more than this fraction of the frame count
+# (0 for constant memory, 1 for memory proportional to frames) is flagged
+# as linear in frames, even within budget
+LINEAR_GROWTH = 0.5
+
+# Frame counts of ``--quick``: both past the buffers a short background
+# still fills (see ``frame_growth``), so their slope is per-frame growth
+QUICK_FRAMES = (3 * BATCH_FRAMES, 6 * BATCH_FRAMES)
+
+
+def max_rss():
+    """Peak resident set size of this process so far, in bytes."""
+    # Linux keeps ru_maxrss across fork and exec, so a child would start at
+    # its parent's peak; the VmHWM of the process's own memory starts afresh
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def measure(renderer, url, background, scale, error, output, trace=False):
+    """
+    Run one render in this process and measure it; meant for a fresh worker process.
+
+    With ``trace`` the render runs under tracemalloc, which sees Python and
+    NumPy allocations but not Pillow's image buffers, and slows the render
+    and inflates RSS, so RSS is measured in a separate run without it.
+
+    Returns:
+        (peak bytes, error message or None): the tracemalloc peak with
+        ``trace``, otherwise how much the render raised the peak RSS
+    """
+    before = max_rss()
+    if trace:
+        tracemalloc.start()
+    try:
+        _, _, failure = benchmark.run_job(renderer, url, background, scale, error, output)
+        peak = tracemalloc.get_traced_memory()[1] if trace else max_rss() - before
+    finally:
+        tracemalloc.stop()
+    return peak, failure
+
+
+def measure_in_child(*args, **kwargs):
+    """``measure`` in a new process, so every run starts from the same, unshared peak RSS."""
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+        return pool.submit(measure, *args, **kwargs).result()
+
+
+def frame_growth(results):
+    """
+    How the peak RSS of one renderer and background size grows with the frame count.
+
+    Only the two longest backgrounds are compared: shorter ones still fill
+    buffers of a fixed size (a batch of ``qr_style.BATCH_FRAMES`` frames),
+    which would look like growth.
+
+    Returns:
+        (bytes per frame, scaling), where ``scaling`` is the relative growth
+        of the peak over the relative growth of the frame count; None with
+        one frame count
+    """
+    peaks = {result["background"]["frames"]: result["rss_peak"] for result in results}
+    if len(peaks) < 2:
+        return None
+    shorter, longer = sorted(peaks)[-2:]
+    per_frame = (peaks[longer] - peaks[shorter]) / (longer - shorter)
+    scaling = (peaks[longer] / max(peaks[shorter], 1) - 1) / (longer / shorter - 1)
+    return per_frame, scaling
+
+
+def check_budgets(results, budgets=BUDGETS, linear_growth=LINEAR_GROWTH):
+    """
+    Compare the results against the budgets.
+
+    Runs are grouped by renderer and background size; the per-frame growth
+    of a group is measured over its frame counts (see ``frame_growth``).
+
+    Returns:
+        (failures, flags, growth): messages over budget, messages of linear
+        growth, and {(renderer, width, height): ``frame_growth``}
+    """
+    failures, flags, growth = [], [], {}
+    for result in results:
+        budget = budgets[result["renderer"]]
+        if result["error_message"]:
+            failures.append(f"{result['renderer']} {describe(result)}: {result['error_message']}")
+        elif result["rss_peak"] > budget.absolute * 1024 * 1024:
+            failures.append(f"{result['renderer']} {describe(result)}: peak RSS +{mb(result['rss_peak'])} MB, "
+                            f"budget {budget.absolute} MB")
+
+    def group(result):
+        return result["renderer"], result["background"]["width"], result["background"]["height"]
+
+    ok = [result for result in results if not result["error_message"]]
+    for key, runs in itertools.groupby(sorted(ok, key=group), key=group):
+        value = frame_growth(list(runs))
+        if value is None:
+            continue
+        growth[key] = value
+        renderer, width, height = key
+        per_frame, scaling = value
+        message = f"{renderer} {width}x{height}: +{per_frame / 1024:.0f} KB per background frame"
+        if per_frame > budgets[renderer].per_frame * 1024:
+            failures.append(f"{message}, budget {budgets[renderer].per_frame} KB")
+        if scaling > linear_growth:
+            flags.append(f"{message}, peak scales {scaling:.2f} with the frame count (linear in frames)")
+    return failures, flags, growth
+
+
+def describe(result):
+    background = result["background"]
+    return f"{background['frames']}f {background['width']}x{background['height']}"
+
+
+def mb(nbytes):
+    return round(nbytes / (1024 * 1024), 1)
+
+
+def run_memory_check(renderers, frame_counts, sizes, scale=8, url_length=40, error="h", workdir=None,
+                     progress=None):
+    """
+    Measure every renderer on synthetic backgrounds and return the report as a dict.
+
+    Each (renderer, background) job runs twice in fresh processes: once
+    for the peak RSS it adds (``rss_peak``) and once under tracemalloc
+    (``traced_peak``), both in bytes.
+
+    Args:
+        renderers: names from ``benchmark.RENDERERS``
+        frame_counts, sizes: synthetic backgrounds, one per (frame count, (width, height))
+        scale, url_length, error: render parameters, fixed for every job
+        workdir: directory for backgrounds and outputs, a temporary one if None
+        progress: optional callable(done, total, result)
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = workdir or tmp
+        os.makedirs(workdir, exist_ok=True)
+        url = benchmark.make_url(url_length)
+        jobs = list(itertools.product(renderers, itertools.product(frame_counts, sizes)))
+        backgrounds = {}
+        results = []
+        for done, (renderer, (frame_count, size)) in enumerate(jobs, 1):
+            path = os.path.join(workdir, f"bg_{frame_count}f_{size[0]}x{size[1]}.gif")
+            if path not in backgrounds:
+                backgrounds[path] = benchmark.synthetic_background(path, frame_count, size)
+            output = os.path.join(workdir, f"out_{renderer}.gif")
+            rss_peak, failure = measure_in_child(renderer, url, path, scale, error, output)
+            traced_peak, _ = measure_in_child(renderer, url, path, scale, error, output, trace=True)
+            result = {
+                "renderer": renderer,
+                "background": {"frames": frame_count, "width": size[0], "height": size[1]},
+                "rss_peak": rss_peak,
+                "traced_peak": traced_peak,
+                "error_message": failure,
+            }
+            if os.path.exists(output):
+                os.remove(output)
+            results.append(result)
+            if progress is not None:
+                progress(done, len(jobs), result)
+
+    failures, flags, growth = check_budgets(results)
+    return {
+        "environment": benchmark.environment(),
+        "config": {
+            "renderers": list(renderers), "frame_counts": list(frame_counts),
+            "sizes": [list(size) for size in sizes], "scale": scale, "url_length": url_length, "error": error,
+            "budgets": {name: budget._asdict() for name, budget in BUDGETS.items()},
+            "linear_growth": LINEAR_GROWTH,
+        },
+        "results": results,
+        "frame_growth": [{"renderer": renderer, "width": width, "height": height,
+                          "bytes_per_frame": round(per_frame), "scaling": round(scaling, 3)}
+                         for (renderer, width, height), (per_frame, scaling) in growth.items()],
+        "failures": failures,
+        "flags": flags,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the peak memory of the QR renderers against their budgets.")
+    parser.add_argument("--renderers", nargs="+", choices=list(benchmark.RENDERERS), default=list(benchmark.RENDERERS))
+    parser.add_argument("--frames", nargs="+", type=int, default=[16, 32, 64], help="background frame counts")
+    parser.add_argument("--sizes", nargs="+", type=benchmark._size, default=[(160, 160), (480, 480)],
+                        help="background sizes, as WIDTHxHEIGHT")
+    parser.add_argument("--quick", action="store_true", help="small backgrounds only")
+    parser.add_argument("--output", default="memory.json", help="JSON report path")
+    args = parser.parse_args(argv)
+
+    if args.quick:
+        args.frames, args.sizes = list(QUICK_FRAMES), [(160, 160)]
+
+    def report(done, total, result):
+        status = result["error_message"] or (f"peak RSS +{mb(result['rss_peak'])} MB, "
+                                             f"traced {mb(result['traced_peak'])} MB")
+        print(f"[{done}/{total}] {result['renderer']} {describe(result)}: {status}")
+
+    report_data = run_memory_check(args.renderers, args.frames, args.sizes, progress=report)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report_data, f, indent=2)
+    for flag in report_data["flags"]:
+        print(f"FLAG: {flag}")
+    for failure in report_data["failures"]:
+        print(f"FAIL: {failure}")
+    print(f"Report saved as {args.output}")
+    return 1 if report_data["failures"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,213 @@
+import math
+import time
+from collections import namedtuple
+from PIL import Image
+import metrics
+
+try:
+    from PIL.Image import Resampling
+except ImportError:
+    Resampling = Image
+
+# A change made to a render to finish within its time budget. ``step`` is
+# "frame_rate", "scale" or "resampling" when planned, "truncated" when the
+# render stopped early; ``detail`` says what changed.
+Degradation = namedtuple("Degradation", "step detail")
+
+# The settings a render is degraded along, in the order they are given up:
+# frame rate cap (None for the source rate), pixels per module, and the
+# resampling filter of the frame resizes
+RenderPlan = namedtuple("RenderPlan", "max_fps scale resample")
+
+# Estimated seconds per rendered frame: a fixed part, and parts per source
+# and per output pixel, fitted on one core over fast-changing synthetic
+# backgrounds. Slower-moving ones encode faster (only changed regions are
+# written), so estimates err long. Filters scale them by ``RESAMPLE_COST``.
+CostModel = namedtuple("CostModel", "frame source_pixel output_pixel")
+
+# Frame rate caps tried in turn, in frames per second
+FPS_STEPS = (20, 12, 8)
+
+# Each scale step keeps this fraction of the module size, down to
+# MIN_MODULE_SIZE pixels; smaller modules stop scanning reliably on phones
+SCALE_STEP = 0.75
+MIN_MODULE_SIZE = 3
+
+# Cheaper filters tried in turn, and their cost relative to Lanczos
+FILTER_STEPS = (Resampling.BILINEAR, Resampling.NEAREST)
+RESAMPLE_COST = {
+    Resampling.LANCZOS: 1.0,
+    Resampling.BICUBIC: 0.95,
+    Resampling.BILINEAR: 0.85,
+    Resampling.NEAREST: 0.55,
+}
+FILTER_NAMES = {
+    Resampling.LANCZOS: "Lanczos",
+    Resampling.BICUBIC: "bicubic",
+    Resampling.BILINEAR: "bilinear",
+    Resampling.NEAREST: "nearest",
+}
+
+# Fraction of the remaining time a plan may be estimated to use; the rest
+# covers opening the background, closing the file and estimation errors
+SAFETY = 0.8
+
+# A next frame is started only with this many average frame times left
+FRAME_MARGIN = 1.5
+
+
+def scale_steps(scale, minimum=MIN_MODULE_SIZE):
+    """Module sizes below ``scale`` tried in turn, each ``SCALE_STEP`` of the last, ending at ``minimum``."""
+    steps = []
+    while scale > minimum:
+        scale = max(minimum, min(scale - 1, int(scale * SCALE_STEP)))
+        steps.append(scale)
+    return steps
+
+
+def kept_frames(frame_count, frame_duration, max_fps):
+    """Frames left of ``frame_count`` frames of ``frame_duration`` ms with a ``max_fps`` cap (see ``timing.retime_frames``)."""
+    if not max_fps:
+        return frame_count
+    return min(frame_count, max(1, math.ceil(frame_count * frame_duration * max_fps / 1000)))
+
+
+def estimate(cost, plan, frame_count, frame_duration, source_pixels, output_pixels):
+    """
+    Estimated seconds to render with ``plan``.
+
+    Args:
+        cost: the renderer's ``CostModel``
+        plan: a ``RenderPlan``
+        frame_count, frame_duration: frames of the background and their duration in ms
+        source_pixels: pixels of a background frame
+        output_pixels: callable giving the pixels of an output frame at a scale
+    """
+    per_frame = cost.frame + source_pixels * cost.source_pixel + output_pixels(plan.scale) * cost.output_pixel
+    return kept_frames(frame_count, frame_duration, plan.max_fps) * per_frame * RESAMPLE_COST.get(plan.resample, 1.0)
+
+
+def degrade_plan(plan, cost_of, budget, scales=(), filters=FILTER_STEPS):
+    """
+    The first plan, giving up frame rate, then scale, then filter quality, estimated to fit ``budget`` seconds.
+
+    Steps that do not lower the estimate are skipped. When even the
+    cheapest plan does not fit, it is returned anyway: a smaller animation
+    late is better than none.
+
+    Args:
+        plan: the requested ``RenderPlan``
+        cost_of: callable giving the estimated seconds of a plan
+        budget: seconds available
+        scales: lower scales to try, in order (see ``scale_steps``)
+        filters: cheaper filters to try, in order
+    """
+    steps = [
+        ("max_fps", [fps for fps in FPS_STEPS if plan.max_fps is None or fps < plan.max_fps]),
+        ("scale", scales),
+        ("resample", [f for f in filters if RESAMPLE_COST.get(f, 1.0) < RESAMPLE_COST.get(plan.resample, 1.0)]),
+    ]
+    cost = cost_of(plan)
+    for field, values in steps:
+        for value in values:
+            if cost <= budget:
+                return plan
+            candidate = plan._replace(**{field: value})
+            candidate_cost = cost_of(candidate)
+            if candidate_cost < cost:
+                plan, cost = candidate, candidate_cost
+    return plan
+
+
+class Deadline:
+    """
+    The time budget of one render, and the degradations applied to meet it.
+
+    A renderer given a deadline first picks the settings estimated to fit
+    (``plan``), then renders its frames through ``frames``, which stops
+    before a frame that would not finish in time; the animation written so
+    far is closed as usual, so a valid file always comes out. Every step
+    given up is listed in ``degradations``, in order, and counted in
+    metrics as ``degraded_<step>``.
+
+    Args:
+        seconds: time budget, from now
+        clock: time source, in seconds
+    """
+
+    def __init__(self, seconds, clock=time.monotonic):
+        self.seconds = seconds
+        self.clock = clock
+        self.start = clock()
+        self.degradations = []
+
+    def elapsed(self):
+        return self.clock() - self.start
+
+    def remaining(self):
+        return self.seconds - self.elapsed()
+
+    def degrade(self, step, detail):
+        """Record a ``Degradation``."""
+        self.degradations.append(Degradation(step, detail))
+        metrics.count(f"degraded_{step}")
+
+    def plan(self, plan, cost_of, scales=(), filters=FILTER_STEPS):
+        """
+        The requested ``plan``, degraded to fit the remaining time (see ``degrade_plan``).
+
+        Records a ``Degradation`` for every setting that changed.
+        """
+        chosen = degrade_plan(plan, cost_of, self.remaining() * SAFETY, scales, filters)
+        if chosen.max_fps != plan.max_fps:
+            self.degrade("frame_rate", f"capped at {chosen.max_fps} fps")
+        if chosen.scale != plan.scale:
+            self.degrade("scale", f"{plan.scale} -> {chosen.scale} pixels per module")
+        if chosen.resample != plan.resample:
+            self.degrade("resampling", f"{FILTER_NAMES.get(plan.resample, plan.resample)} -> "
+                                       f"{FILTER_NAMES.get(chosen.resample, chosen.resample)}")
+        return chosen
+
+    def frames(self, timed_frames, batch=1):
+        """
+        Yield from ``timed_frames`` while the next frame is expected to finish in time.
+
+        The first frame is always yielded. A frame is expected to take the
+        average time the consumer spent on those before (e.g. encoding
+        them), plus, when it starts a new batch, the average time to
+        produce a frame times ``batch``; it is only started with
+        ``FRAME_MARGIN`` times that left.
+
+        Args:
+            timed_frames: iterable of items, e.g. (frame, duration) pairs
+            batch: items are produced ``batch`` at a time, the first of each
+                batch taking the time of all (see ``frame_pool.map_timed_batches``)
+        """
+        iterator = iter(timed_frames)
+        produce = consume = 0.0
+        done = 0
+        try:
+            while True:
+                if done:
+                    needed = consume / done + (produce / done * batch if done % batch == 0 else 0)
+                    if self.remaining() < needed * FRAME_MARGIN:
+                        self.degrade("truncated", f"stopped after {done} frames")
+                        return
+                start = self.clock()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                produced = self.clock()
+                produce += produced - start
+                yield item
+                consume += self.clock() - produced
+                done += 1
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+
+    def summary(self):
+        """The degradations as one line of text, empty when there were none."""
+        return "; ".join(f"{step}: {detail}" for step, detail in self.degradations)
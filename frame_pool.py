@@ -0,0 +1,149 @@
+import atexit
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from PIL import ImageSequence
+
+# Below this many frames, pickling frames to worker processes costs more than it saves
+MIN_PARALLEL_FRAMES = 24
+
+# Frames sent to a worker in one task
+CHUNK_SIZE = 4
+
+_pools = {}
+
+
+def resolve_workers(workers):
+    """Normalize a worker count: ``None`` or ``0`` means one worker per CPU core."""
+    if not workers:
+        return os.cpu_count() or 1
+    return max(1, int(workers))
+
+
+def get_pool(workers):
+    """Return a warm process pool with ``workers`` processes, created on first use and reused afterwards."""
+    pool = _pools.get(workers)
+    if pool is None:
+        pool = ProcessPoolExecutor(max_workers=workers)
+        _pools[workers] = pool
+    return pool
+
+
+@atexit.register
+def shutdown_pools():
+    """Stop every warm pool."""
+    while _pools:
+        _, pool = _pools.popitem()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def iter_frames(image):
+    """Yield an independent copy of every frame of ``image``, safe to send to another process."""
+    for frame in ImageSequence.Iterator(image):
+        yield frame.copy()
+
+
+def sample_indices(total, count=8):
+    """Indices of up to ``count`` frames spread evenly over ``total`` frames, in order."""
+    count = min(count, total)
+    return sorted({round(i * (total - 1) / max(count - 1, 1)) for i in range(count)})
+
+
+def sample_frames(image, count=8):
+    """
+    Yield copies of up to ``count`` frames spread evenly over the animation.
+
+    The image is rewound to its first frame afterwards, ready for ``iter_frames``.
+    """
+    indices = sample_indices(getattr(image, "n_frames", 1), count)
+    try:
+        for index in indices:
+            image.seek(index)
+            yield image.copy()
+    finally:
+        image.seek(0)
+
+
+def _apply_chunk(func, chunk):
+    return [func(item) for item in chunk]
+
+
+def map_frames(func, frames, workers=1, frame_count=None,
+               min_parallel_frames=MIN_PARALLEL_FRAMES, chunksize=CHUNK_SIZE):
+    """
+    Apply ``func`` to every frame and yield the results in input order.
+
+    Runs serially unless more than one worker is requested and the animation
+    has at least ``min_parallel_frames`` frames. In parallel mode frames are
+    sent to a warm process pool in chunks, keeping only a few chunks per
+    worker in flight, so ``func`` and the frames must be picklable.
+
+    Args:
+        func: picklable callable applied to each frame
+        frames: iterable of frames (see ``iter_frames``)
+        workers: number of worker processes; 1 is serial, ``None`` or ``0`` uses every core
+        frame_count: number of frames, if known, used for the serial fallback
+        min_parallel_frames: smallest animation worth parallelizing
+        chunksize: frames per worker task
+    """
+    workers = resolve_workers(workers)
+    if workers == 1 or (frame_count is not None and frame_count < min_parallel_frames):
+        for frame in frames:
+            yield func(frame)
+        return
+
+    pool = get_pool(workers)
+    pending = deque()
+    frames = iter(frames)
+    while True:
+        chunk = [frame for _, frame in zip(range(chunksize), frames)]
+        if chunk:
+            pending.append(pool.submit(_apply_chunk, func, chunk))
+        if pending and (not chunk or len(pending) >= 2 * workers):
+            yield from pending.popleft().result()
+        elif not chunk:
+            return
+
+
+def map_timed_frames(func, timed_frames, **kwargs):
+    """
+    ``map_frames`` for (frame, duration) pairs: yields (func(frame), duration) in input order.
+
+    Takes the same keyword arguments as ``map_frames``; only the frames
+    are sent to the workers.
+    """
+    durations = deque()
+
+    def frames():
+        for frame, duration in timed_frames:
+            durations.append(duration)
+            yield frame
+
+    for result in map_frames(func, frames(), **kwargs):
+        yield result, durations.popleft()
+
+
+def map_timed_batches(func, timed_frames, batch_size, **kwargs):
+    """
+    ``map_timed_frames`` for a ``func`` that takes a list of frames and returns a list of results.
+
+    Frames are grouped into lists of up to ``batch_size``; each list is
+    one worker task. Yields (result, duration) pairs in input order. Takes
+    the same keyword arguments as ``map_frames``, except ``chunksize``.
+    """
+    durations = deque()
+
+    def batches():
+        batch = []
+        for frame, duration in timed_frames:
+            durations.append(duration)
+            batch.append(frame)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    for results in map_frames(func, batches(), chunksize=1, **kwargs):
+        for result in results:
+            yield result, durations.popleft()
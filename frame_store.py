@@ -0,0 +1,122 @@
+import os
+import tempfile
+from collections import namedtuple
+from multiprocessing import shared_memory
+import numpy as np
+from PIL import Image
+from timing import DEFAULT_DURATION, iter_timed_frames
+
+# What a worker process needs to attach to a ``FrameStore``: the shared
+# memory block name (or temporary file path, with ``on_disk``) and the
+# (frames, height, width, 4) shape of the buffer
+StoreRef = namedtuple("StoreRef", "name shape on_disk")
+
+
+class FrameStore:
+    """
+    Decoded RGBA frames in one contiguous (frames, height, width, 4) uint8 buffer.
+
+    The buffer lives in ``multiprocessing.shared_memory``, or in a
+    memory-mapped temporary file with ``on_disk`` (for hosts with a small
+    /dev/shm). Worker processes attach to it by ``ref`` and read or write
+    ``frames[i]`` in place, so frames never go through pickling. The store
+    that created the buffer removes it on ``close``; attached stores only
+    unmap it.
+
+    Args:
+        shape: (frames, height, width, 4) of a new buffer
+        on_disk: back a new buffer with a temporary file instead of shared memory
+        ref: a ``StoreRef`` to attach to an existing buffer instead
+    """
+
+    def __init__(self, shape=None, on_disk=False, ref=None):
+        self.owner = ref is None
+        if ref is None:
+            shape = tuple(shape)
+            nbytes = max(int(np.prod(shape)), 1)
+            if on_disk:
+                fd, name = tempfile.mkstemp(prefix="qr_frames_", suffix=".raw")
+                os.close(fd)
+                self.frames = np.memmap(name, dtype=np.uint8, mode="w+", shape=shape)
+                self._shm = None
+            else:
+                self._shm = shared_memory.SharedMemory(create=True, size=nbytes)
+                name = self._shm.name
+                self.frames = np.ndarray(shape, dtype=np.uint8, buffer=self._shm.buf)
+            ref = StoreRef(name, shape, on_disk)
+        elif ref.on_disk:
+            self.frames = np.memmap(ref.name, dtype=np.uint8, mode="r+", shape=ref.shape)
+            self._shm = None
+        else:
+            # Pool workers share the owner's resource tracker, so attaching does not make them unlink it
+            self._shm = shared_memory.SharedMemory(name=ref.name)
+            self.frames = np.ndarray(ref.shape, dtype=np.uint8, buffer=self._shm.buf)
+        self.ref = ref
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __len__(self):
+        return self.ref.shape[0]
+
+    def image(self, index):
+        """Frame ``index`` as an RGBA image over the buffer, without a copy; valid until ``close``."""
+        return Image.fromarray(self.frames[index], "RGBA")
+
+    def close(self):
+        """Unmap the buffer; the owner also removes it."""
+        if self.frames is None:
+            return
+        self.frames = None
+        if self._shm is not None:
+            self._shm.close()
+            if self.owner:
+                self._shm.unlink()
+        elif self.owner:
+            os.remove(self.ref.name)
+
+
+def decode_frames(image, shrink_to=None, default_duration=DEFAULT_DURATION, on_disk=False):
+    """
+    Decode every frame of ``image`` once into a new ``FrameStore``.
+
+    Frames are converted to RGBA as they are written, as the compositing
+    functions convert them, and shrunk first with ``shrink_to`` (see
+    ``timing.iter_timed_frames``).
+
+    Returns:
+        (store, durations): the store, owned by the caller, and the frame durations in milliseconds
+    """
+    timed = iter_timed_frames(image, default_duration, shrink_to)
+    first, duration = next(timed)
+    first = np.asarray(first.convert("RGBA"))
+    store = FrameStore((getattr(image, "n_frames", 1),) + first.shape, on_disk=on_disk)
+    try:
+        store.frames[0] = first
+        durations = [duration]
+        for index, (frame, duration) in enumerate(timed, 1):
+            store.frames[index] = np.asarray(frame.convert("RGBA"))
+            durations.append(duration)
+    except BaseException:
+        store.close()
+        raise
+    return store, durations
+
+
+def apply_stored(func, ref, indices):
+    """
+    ``func(frames)`` for the frames at ``indices`` of the store ``ref``; picklable with ``functools.partial``.
+
+    The store is attached for this call only, so a worker kept warm by the
+    pool does not hold the buffer mapped after its owner removes it.
+    """
+    with FrameStore(ref=ref) as store:
+        frames = [store.image(index) for index in indices]
+        try:
+            return func(frames)
+        finally:
+            # The images are views of the buffer, which cannot be unmapped while they exist
+            del frames
@@ -0,0 +1,485 @@
+import io
+import struct
+from collections import deque, namedtuple
+from concurrent.futures import Future
+import numpy as np
+from PIL import Image
+import metrics
+from frame_pool import get_pool, resolve_workers
+from ingest import skip_sub_blocks
+
+# One encoded GIF image: local color table, transparent index and the
+# image descriptor fields plus LZW data, ready to be appended to a stream
+EncodedFrame = namedtuple("EncodedFrame", "palette transparency box interlace data")
+
+
+def encode_frame(frame, optimize=True):
+    """
+    Quantize and LZW-compress a single frame with Pillow.
+
+    The frame is saved as a standalone GIF in memory and split into the
+    pieces needed to append it to another GIF stream.
+
+    Args:
+        frame: PIL image in any mode Pillow can save as GIF
+        optimize: let Pillow drop unused palette entries (and with them an
+            unused transparent index)
+
+    Returns:
+        An ``EncodedFrame``
+    """
+    buffer = io.BytesIO()
+    frame.save(buffer, "GIF", interlace=False, optimize=optimize)
+    data = buffer.getvalue()
+
+    flags = data[10]
+    pos = 13
+    palette = b""
+    if flags & 0x80:
+        size = 3 << ((flags & 7) + 1)
+        palette = data[pos:pos + size]
+        pos += size
+
+    transparency = None
+    while data[pos] == 0x21:  # Extension blocks
+        if data[pos + 1] == 0xF9 and data[pos + 3] & 1:  # Graphic control extension
+            transparency = data[pos + 6]
+        pos = skip_sub_blocks(data, pos + 2)
+
+    if data[pos] != 0x2C:
+        raise ValueError("No image data in encoded frame")
+    box = struct.unpack("<HHHH", data[pos + 1:pos + 9])
+    flags = data[pos + 9]
+    pos += 10
+    if flags & 0x80:
+        size = 3 << ((flags & 7) + 1)
+        palette = data[pos:pos + size]
+        pos += size
+    end = skip_sub_blocks(data, pos + 1)  # Skip the LZW minimum code size
+    return EncodedFrame(palette, transparency, box, bool(flags & 0x40), data[pos:end])
+
+
+# Delta frames whose colour changes are within this ratio of the full
+# region's are encoded both ways to keep the smaller
+CLOSE_EDGES = 1.1
+
+# GIF disposal methods
+DISPOSE_KEEP = 1  # Leave the frame on screen; the next frame draws over it
+DISPOSE_BACKGROUND = 2  # Clear the frame's rectangle to transparent before the next frame
+
+
+def palette_colors(palette, transparency=None):
+    """
+    (256, 4) RGBA table of a palette.
+
+    Args:
+        palette: RGB palette bytes or list, as ``Image.getpalette`` gives it
+        transparency: transparent index, bytes of per-index alphas, or None
+    """
+    colors = np.full((256, 4), 255, dtype=np.uint8)
+    palette = np.frombuffer(bytes(palette or b""), dtype=np.uint8)[:768]
+    palette = palette[:len(palette) // 3 * 3].reshape(-1, 3)
+    colors[:len(palette), :3] = palette
+    colors[len(palette):, :3] = 0
+    if isinstance(transparency, int):
+        colors[transparency, 3] = 0
+    elif isinstance(transparency, bytes):
+        colors[:len(transparency), 3] = np.frombuffer(transparency, dtype=np.uint8)[:256]
+    return colors
+
+
+def lookup_rgba(colors, indices):
+    """RGBA array of palette ``indices`` through a ``palette_colors`` table."""
+    # One 32-bit gather per pixel instead of four byte gathers
+    return colors.view(np.uint32)[:, 0][indices].view(np.uint8).reshape(indices.shape + (4,))
+
+
+def rgba_array(frame):
+    """
+    RGBA pixels of ``frame`` as an array.
+
+    Paletted frames are looked up in their palette directly:
+    ``convert("RGBA")`` would switch the frame's own palette to RGBA when it
+    has a transparent index, which Pillow's GIF encoder then misreads.
+    """
+    if frame.mode != "P":
+        return np.asarray(frame if frame.mode == "RGBA" else frame.convert("RGBA"))
+    return lookup_rgba(palette_colors(frame.getpalette(), frame.info.get("transparency")), np.asarray(frame))
+
+
+def _pixels(rgba):
+    # Little-endian words, so a pixel's alpha is the high byte
+    return np.ascontiguousarray(rgba).view("<u4")[..., 0]
+
+
+def clear_mask(rgba):
+    """Fully transparent pixels of an RGBA array."""
+    return _pixels(rgba) < 1 << 24
+
+
+def changed_mask(previous, current):
+    """
+    Pixels that differ between two RGBA arrays.
+
+    Fully transparent pixels compare equal whatever their colour channels.
+    """
+    # One 32-bit comparison per pixel instead of four byte comparisons
+    changed = _pixels(previous) != _pixels(current)
+    clear = clear_mask(current)
+    if clear.any():
+        changed &= ~(clear & clear_mask(previous))
+    return changed
+
+
+def mask_box(mask):
+    """Bounding box (left, upper, right, lower) of the True pixels of a 2D mask, or None."""
+    rows = np.flatnonzero(mask.any(axis=1))
+    if not rows.size:
+        return None
+    cols = np.flatnonzero(mask.any(axis=0))
+    return (int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1)
+
+
+def palette_indices(frame, need_index=False):
+    """
+    ``frame`` as palette indices, with a transparent index for its transparent pixels.
+
+    Paletted frames keep their palette and use their transparent index, or
+    with ``need_index`` a free one; other frames are quantized once to at
+    most 255 colours so that entry 255 is left for transparency.
+
+    Returns:
+        (indices, palette, index): a writable (height, width) uint8 array,
+        the 768-entry RGB palette as a list, and the transparent index or None
+    """
+    index = None
+    if frame.mode == "P" and not isinstance(frame.info.get("transparency"), bytes):
+        indices = np.array(frame)
+        index = frame.info.get("transparency")
+        if index is None and need_index:
+            free = np.flatnonzero(np.array(frame.histogram()) == 0)
+            index = int(free[0]) if free.size else None
+        if index is not None or not need_index:
+            palette = frame.getpalette()
+            return indices, palette + [0] * (768 - len(palette)), index
+    image = frame if frame.mode == "RGBA" else Image.fromarray(rgba_array(frame), "RGBA")
+    # Quantized in RGBA as Pillow's GIF encoder does: its fast octree leaves far fewer
+    # colour edges to compress than median cut over RGB
+    quantized = image.convert("P", palette=Image.Palette.ADAPTIVE, colors=255)
+    indices = np.array(quantized)
+    clear = np.asarray(image.getchannel("A")) == 0
+    if need_index or clear.any():
+        index = 255
+        indices[clear] = index
+    palette = quantized.getpalette()
+    return indices, palette + [0] * (768 - len(palette)), index
+
+
+def _encode_indices(indices, palette, index, keep_palette):
+    frame = Image.fromarray(indices, "P")
+    if not keep_palette:
+        # Drop unused palette entries, as Pillow's optimize would, but keep the transparent index
+        used = np.array(frame.histogram()) != 0
+        if index is not None:
+            used[index] = True
+        order = np.flatnonzero(used)
+        if len(order) <= 128:  # Over 128 colours the color table keeps 256 entries anyway
+            remap = np.zeros(256, dtype=np.uint8)
+            remap[order] = np.arange(len(order))
+            frame = Image.fromarray(remap[indices], "P")
+            palette = np.asarray(palette, dtype=np.uint8).reshape(-1, 3)[order].ravel().tolist()
+            index = None if index is None else int(remap[index])
+    frame.putpalette(palette)
+    if index is not None:
+        frame.info["transparency"] = index
+    return encode_frame(frame, optimize=False)
+
+
+def _edges(indices):
+    # Colour changes along the rows: each one breaks an LZW run, so fewer encode smaller
+    return np.count_nonzero(indices[:, 1:] != indices[:, :-1])
+
+
+def encode_region(frame, keep, transparent=False, keep_palette=False):
+    """
+    Encode ``frame``, with its ``keep`` pixels transparent if that is smaller, as an ``EncodedFrame``.
+
+    The unchanged pixels of a delta frame can be left transparent (the
+    screen shows through) or stored as they are. Transparent runs compress
+    well when few pixels changed, but scattered ones break up runs of one
+    colour. Both versions come from the same indices; the one with fewer
+    colour changes along its rows is encoded, or both and the smaller kept
+    when they are within ``CLOSE_EDGES`` of each other.
+
+    Picklable, so frames can be encoded in worker processes.
+
+    Args:
+        frame: PIL image, already cropped to the region to store
+        keep: 2D boolean array of the pixels left as they are on screen
+        transparent: give the frame a transparent index even if no pixel uses it
+        keep_palette: store paletted frames with their palette as it is, so
+            they can use a global color table
+    """
+    has_keep = keep.any()
+    indices, palette, index = palette_indices(frame, need_index=transparent or has_keep)
+    if not has_keep:
+        return _encode_indices(indices, palette, index, keep_palette)
+    delta = indices.copy()
+    delta[keep] = index
+    edges, delta_edges = _edges(indices), _edges(delta)
+    encoded = None
+    if edges <= delta_edges * CLOSE_EDGES:
+        encoded = _encode_indices(indices, palette, index, keep_palette)
+    if delta_edges <= edges * CLOSE_EDGES:
+        candidate = _encode_indices(delta, palette, index, keep_palette)
+        if encoded is None or len(candidate.data) < len(encoded.data):
+            encoded = candidate
+    return encoded
+
+
+def _result(encoded):
+    return encoded.result() if isinstance(encoded, Future) else encoded
+
+
+class _PendingFrame:
+    """An encoded frame held back until the next one decides its disposal and duration."""
+
+    def __init__(self, frame, encoded, box, duration, keep):
+        self.frame = frame
+        self.encoded = encoded
+        self.box = box
+        self.duration = duration
+        self.keep = keep
+        self.disposal = DISPOSE_KEEP
+
+
+class GifWriter:
+    """
+    Write an animated GIF one frame at a time.
+
+    Each frame is encoded and written to the target as soon as the next one
+    arrives, with its own local color table, so memory use does not depend
+    on the number of frames. Frames are delta-coded against what is already
+    on screen: only the bounding box of the changed pixels is stored, pixels
+    in it that are unchanged become transparent when that encodes smaller
+    (see ``encode_region``), and identical consecutive frames are merged
+    into one with the summed duration.
+
+    Frames stay on screen (disposal 1) unless the next frame needs pixels
+    to turn transparent again, which only restoring to background
+    (disposal 2) can do; the held-back frame is then switched to disposal 2
+    and, if its rectangle does not cover those pixels, re-encoded whole.
+
+    With a global ``palette``, it is written once as the global color
+    table, and paletted frames that use it are stored as they are, with
+    no local color table and no requantization. While every frame uses it,
+    frames are compared by palette index, without expanding them to RGBA.
+
+    With more than one worker, the changed regions are still found here,
+    but quantizing and LZW-compressing them (``encode_region``) runs in a
+    warm process pool; each worker returns a self-contained image block,
+    and the blocks are written in order behind their graphic control
+    extensions, a few frames per worker kept in flight. The file is the
+    same as when encoded serially.
+
+    Args:
+        target: filename or writable binary file object
+        duration: default frame duration in milliseconds
+        loop: number of loops, 0 loops forever, None plays once
+        palette: optional global color table as 768 RGB bytes (see ``palette.GlobalPalette``)
+        workers: number of worker processes encoding frames; 1 encodes
+            here, ``None`` or ``0`` uses every core (see ``frame_pool.get_pool``)
+    """
+
+    def __init__(self, target, duration=50, loop=0, palette=None, workers=1):
+        if isinstance(target, (str, bytes)) or hasattr(target, "__fspath__"):
+            self.fp = open(target, "wb")
+            self._owns_fp = True
+        else:
+            self.fp = target
+            self._owns_fp = False
+        self.duration = duration
+        self.loop = loop
+        self.palette = bytes(palette) if palette is not None else None
+        self.workers = resolve_workers(workers)
+        if self.palette is not None and len(self.palette) != 768:
+            raise ValueError("The global palette must have 256 RGB entries")
+        self.size = None
+        self.frame_count = 0
+        self.bytes_written = 0
+        self._canvas = None  # The screen once the pending frame is drawn, as _screen_pixels gives it
+        self._indexed = None  # Whether the canvas holds global palette indices, decided by the first frame
+        self._transparency = None  # Transparent index of the indexed canvas
+        self._pending = None
+        self._queue = deque()  # (encoded, offset, duration, disposal) of frames not written yet
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        elif self._owns_fp:
+            self.fp.close()
+
+    def _write(self, data):
+        self.fp.write(data)
+        self.bytes_written += len(data)
+
+    def _write_header(self, size):
+        self.size = size
+        if self.palette is None:
+            # Logical screen descriptor without a global color table
+            self._write(b"GIF89a" + struct.pack("<HHBBB", size[0], size[1], 0, 0, 0))
+        else:
+            # 256-entry global color table, 8 bits per primary
+            self._write(b"GIF89a" + struct.pack("<HHBBB", size[0], size[1], 0xF7, 0, 0) + self.palette)
+        if self.loop is not None:
+            self._write(b"!\xff\x0bNETSCAPE2.0\x03\x01" + struct.pack("<H", self.loop) + b"\x00")
+
+    def _write_frame(self, encoded, offset, duration, disposal=0):
+        encoded = _result(encoded)
+        transparency = encoded.transparency
+        packed = (disposal << 2) | (transparency is not None)
+        self._write(
+            b"!\xf9\x04"
+            + struct.pack("<BHBB", packed, int(duration / 10), transparency or 0, 0)
+        )
+        flags = 0x40 if encoded.interlace else 0
+        palette = encoded.palette
+        if palette == self.palette:
+            palette = b""
+        if palette:
+            flags |= 0x80 | ((len(palette) // 3).bit_length() - 2)
+        _, _, width, height = encoded.box
+        self._write(b"," + struct.pack("<HHHHB", offset[0], offset[1], width, height, flags))
+        self._write(palette)
+        self._write(encoded.data)
+        self.frame_count += 1
+
+    def _flush(self, in_flight=0):
+        """Queue the pending frame, then write queued frames until at most ``in_flight`` are left."""
+        pending = self._pending
+        if pending is not None:
+            self._queue.append((pending.encoded, pending.box[:2], pending.duration, pending.disposal))
+            self._pending = None
+        while len(self._queue) > in_flight:
+            self._write_frame(*self._queue.popleft())
+
+    def _encode(self, frame, box, keep, transparent=False):
+        """
+        Encode the ``box`` region of ``frame``, its ``keep`` pixels transparent if that is smaller.
+
+        With ``transparent`` the frame gets a transparent index even if no
+        pixel uses it: decoders that follow Pillow's convention restore a
+        disposed frame to its transparent colour, and otherwise to the
+        opaque background colour.
+        """
+        left, upper, right, lower = box
+        if box != (0, 0) + frame.size:
+            frame = frame.crop(box)
+        keep = keep[upper:lower, left:right]
+        # Keep the palette as it is so the frame can use the global color table
+        keep_palette = self.palette is not None
+        if self.workers > 1:
+            return get_pool(self.workers).submit(encode_region, frame, keep, transparent, keep_palette)
+        return encode_region(frame, keep, transparent, keep_palette)
+
+    def _uses_palette(self, frame, transparency):
+        return (frame.mode == "P" and frame.info.get("transparency") == transparency
+                and bytes(frame.getpalette()) == self.palette)
+
+    def _screen_pixels(self, frame):
+        """
+        ``frame`` as the canvas holds it: palette indices while every frame uses the global palette, else RGBA.
+        """
+        if self._indexed is None:
+            transparency = frame.info.get("transparency")
+            self._indexed = (self.palette is not None and not isinstance(transparency, bytes)
+                             and self._uses_palette(frame, transparency))
+            self._transparency = transparency if self._indexed else None
+        if self._indexed:
+            if self._uses_palette(frame, self._transparency):
+                return np.asarray(frame)
+            # A frame off the global palette: compare in RGBA from here on
+            self._indexed = False
+            self._canvas = lookup_rgba(palette_colors(self.palette, self._transparency), self._canvas)
+        return rgba_array(frame)
+
+    def _transparent(self, pixels):
+        """The transparent pixels of a canvas or ``_screen_pixels`` array."""
+        if not self._indexed:
+            return clear_mask(pixels)
+        if self._transparency is None:
+            return np.zeros(pixels.shape, dtype=bool)
+        return pixels == self._transparency
+
+    def _clear_for(self, clear):
+        """
+        Switch the pending frame to restore-to-background so the ``clear`` pixels can turn transparent.
+
+        Returns the screen as the next frame will find it.
+        """
+        pending = self._pending
+        pending.disposal = DISPOSE_BACKGROUND
+        blank = self._transparency if self._indexed else 0
+        canvas = self._canvas.copy()
+        left, upper, right, lower = pending.box
+        canvas[upper:lower, left:right] = blank
+        if (clear & ~self._transparent(canvas)).any():
+            # Its rectangle is too small: store the pending frame whole, so it clears everything
+            pending.box = (0, 0) + self.size
+            pending.encoded = self._encode(pending.frame, pending.box, self._transparent(self._canvas),
+                                           transparent=True)
+            canvas[:] = blank
+        elif _result(pending.encoded).transparency is None:
+            pending.encoded = self._encode(pending.frame, pending.box, pending.keep, transparent=True)
+        return canvas
+
+    def write(self, frame, duration=None):
+        """Add ``frame`` to the GIF, shown for ``duration`` milliseconds."""
+        metrics.count("frames")
+        metrics.count("pixels", frame.width * frame.height)
+        with metrics.span("encode"):
+            self._write_image(frame, self.duration if duration is None else duration)
+
+    def _write_image(self, frame, duration):
+        pixels = self._screen_pixels(frame)
+        clear = self._transparent(pixels)
+        if self.size is None:
+            self._write_header(frame.size)
+            changed = ~clear  # The screen starts out transparent
+        else:
+            canvas = self._canvas
+            # Drawing can only add opaque pixels; clearing needs the previous frame disposed
+            cleared = clear.any() and (clear & ~self._transparent(canvas)).any()
+            if cleared:
+                canvas = self._clear_for(clear)
+            changed = canvas != pixels if self._indexed else changed_mask(canvas, pixels)
+            if not cleared and not changed.any():
+                self._pending.duration += duration
+                return
+
+        box = mask_box(changed) or (0, 0, 1, 1)
+        # Outside a cropped first frame the screen must read as transparent too
+        first = self._pending is None and box != (0, 0) + self.size
+        keep = ~changed
+        encoded = self._encode(frame, box, keep, transparent=first)
+        self._flush(in_flight=2 * self.workers if self.workers > 1 else 0)
+        self._pending = _PendingFrame(frame, encoded, box, duration, keep)
+        self._canvas = pixels
+
+    def close(self):
+        """Write the last frame and the trailer, and close the target if it was opened here."""
+        try:
+            if self._pending is None:
+                raise ValueError("No frames to write")
+            with metrics.span("encode"):
+                self._flush()
+            self._write(b";")
+            if hasattr(self.fp, "flush"):
+                self.fp.flush()
+            metrics.count("bytes_out", self.bytes_written)
+        finally:
+            if self._owns_fp:
+                self.fp.close()
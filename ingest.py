@@ -0,0 +1,180 @@
+import os
+import struct
+from collections import namedtuple
+from PIL import Image
+
+# Limits a background must meet before any frame is decoded. Decoding time
+# and memory grow with the frames times their pixels, so that product is
+# capped too; frames larger than a render needs are shrunk as they load.
+IngestLimits = namedtuple("IngestLimits", "max_bytes max_frames max_frame_pixels max_total_pixels")
+
+DEFAULT_LIMITS = IngestLimits(
+    max_bytes=20 * 1024 * 1024,
+    max_frames=500,
+    max_frame_pixels=4096 * 4096,
+    max_total_pixels=600_000_000,
+)
+
+# What the header of a background says, read without decoding any pixel
+BackgroundInfo = namedtuple("BackgroundInfo", "format width height frames nbytes")
+
+# Shrunk frames keep at least this many pixels per output pixel, so the final resize still filters
+SUPERSAMPLE = 2
+
+
+class IngestError(ValueError):
+    """The background is over the ingest limits or cannot be read."""
+
+
+def _source_size(source):
+    if isinstance(source, (str, bytes)) or hasattr(source, "__fspath__"):
+        return os.path.getsize(source)
+    position = source.tell()
+    source.seek(0, os.SEEK_END)
+    size = source.tell() - position
+    source.seek(position)
+    return size
+
+
+def skip_sub_blocks(data, pos):
+    """Position just past the GIF data sub-blocks starting at ``pos`` and their terminator."""
+    while data[pos]:
+        pos += data[pos] + 1
+    return pos + 1
+
+
+def _scan_gif(data):
+    """(width, height, frame count) from the GIF block structure, skipping the LZW data undecoded."""
+    if len(data) < 13:
+        raise IngestError("Unreadable background image: truncated GIF header")
+    width, height, flags = struct.unpack_from("<HHB", data, 6)
+    pos = 13
+    if flags & 0x80:
+        pos += 3 << ((flags & 7) + 1)
+    frames = 0
+    try:
+        while pos < len(data) and data[pos] != 0x3B:
+            if data[pos] == 0x21:
+                # Extension: label, then sub-blocks
+                pos = skip_sub_blocks(data, pos + 2)
+            elif data[pos] == 0x2C:
+                flags = data[pos + 9]
+                pos += 10
+                if flags & 0x80:
+                    pos += 3 << ((flags & 7) + 1)
+                # LZW minimum code size, then the image data sub-blocks
+                pos = skip_sub_blocks(data, pos + 1)
+                frames += 1
+            else:
+                break
+    except IndexError:
+        pass  # Truncated file: decoders show the frames that are complete
+    return width, height, frames
+
+
+def check_size(nbytes, max_bytes):
+    """Raise ``IngestError`` if ``nbytes`` is over ``max_bytes``."""
+    if nbytes > max_bytes:
+        raise IngestError(f"Background is {nbytes / 2 ** 20:.1f} MB, the limit is {max_bytes / 2 ** 20:.1f} MB")
+
+
+def probe(source, max_bytes=None):
+    """
+    Read the size and frame count of a background without decoding it.
+
+    GIFs are read block by block; other formats use the lazy header of
+    ``Image.open``. File objects are left at the position they had.
+
+    Args:
+        source: path or seekable binary file object
+        max_bytes: largest source accepted, checked before anything is read
+
+    Returns:
+        A ``BackgroundInfo``
+
+    Raises:
+        IngestError: when the source is over ``max_bytes`` or unreadable
+    """
+    nbytes = _source_size(source)
+    if max_bytes is not None:
+        check_size(nbytes, max_bytes)
+    if isinstance(source, (str, bytes)) or hasattr(source, "__fspath__"):
+        with open(source, "rb") as f:
+            head = f.read(6)
+    else:
+        position = source.tell()
+        head = source.read(6)
+        source.seek(position)
+
+    if head in (b"GIF87a", b"GIF89a"):
+        if hasattr(source, "read"):
+            position = source.tell()
+            data = source.read()
+            source.seek(position)
+        else:
+            with open(source, "rb") as f:
+                data = f.read()
+        width, height, frames = _scan_gif(data)
+        return BackgroundInfo("GIF", width, height, frames, nbytes)
+
+    try:
+        with Image.open(source) as image:
+            info = BackgroundInfo(image.format, image.width, image.height, getattr(image, "n_frames", 1), nbytes)
+    except (OSError, SyntaxError) as e:
+        raise IngestError(f"Unreadable background image: {e}") from e
+    finally:
+        if hasattr(source, "seek"):
+            source.seek(position)
+    return info
+
+
+def check_limits(info, limits=DEFAULT_LIMITS):
+    """Raise ``IngestError`` if a ``BackgroundInfo`` is over ``limits``."""
+    check_size(info.nbytes, limits.max_bytes)
+    if info.frames < 1:
+        raise IngestError("Background has no frames")
+    if info.frames > limits.max_frames:
+        raise IngestError(f"Background has {info.frames} frames, the limit is {limits.max_frames}")
+    pixels = info.width * info.height
+    if pixels > limits.max_frame_pixels:
+        raise IngestError(f"Background is {info.width}x{info.height}, the limit is "
+                          f"{limits.max_frame_pixels} pixels per frame")
+    if pixels * info.frames > limits.max_total_pixels:
+        raise IngestError(f"Background has {info.frames} frames of {info.width}x{info.height}, the limit is "
+                          f"{limits.max_total_pixels} pixels over all frames")
+
+
+def open_background(source, limits=DEFAULT_LIMITS):
+    """
+    Check a background against ``limits`` and open it (lazily, as ``Image.open`` does).
+
+    Args:
+        source: path or seekable binary file object
+        limits: an ``IngestLimits``, or None to skip the checks
+
+    Raises:
+        IngestError: when the background is over the limits
+    """
+    if limits is not None:
+        check_limits(probe(source, limits.max_bytes), limits)
+    return Image.open(source)
+
+
+def shrink_frame(frame, size, supersample=SUPERSAMPLE):
+    """
+    Return a copy of ``frame``, cheaply shrunk if it is much larger than ``size``.
+
+    A frame at least ``2 * supersample`` times the target size in both
+    directions is reduced by an integer factor that keeps it at least
+    ``supersample`` times the target size: box-averaged with
+    ``Image.reduce`` for RGB(A) and greyscale frames, and subsampled in
+    place for paletted frames, before they are converted to RGBA. The
+    final, filtered resize to ``size`` is left to the caller.
+    """
+    factor = min(frame.width // (size[0] * supersample), frame.height // (size[1] * supersample))
+    if factor < 2:
+        return frame.copy()
+    if frame.mode in ("RGB", "RGBA", "L", "LA"):
+        return frame.reduce(factor)
+    # Palette indices cannot be averaged; keep every factor-th pixel and the palette, at the size reduce() gives
+    return frame.resize((-(-frame.width // factor), -(-frame.height // factor)), Image.NEAREST)
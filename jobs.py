@@ -0,0 +1,113 @@
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class QueueFull(Exception):
+    """Raised by ``JobQueue.submit`` when too many jobs are already waiting."""
+
+
+class Job:
+    """State of one background job; safe to poll from any thread."""
+
+    def __init__(self, job_id):
+        self.id = job_id
+        self.status = "queued"  # queued, running, done or failed
+        self.done = 0
+        self.total = 0
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished_at = None
+
+    def report(self, done, total):
+        """Progress callback handed to the job function."""
+        self.done, self.total = done, total
+
+    @property
+    def fraction(self):
+        """Completed fraction between 0 and 1."""
+        if self.status == "done":
+            return 1.0
+        return self.done / self.total if self.total else 0.0
+
+    @property
+    def finished(self):
+        return self.status in ("done", "failed")
+
+
+class JobQueue:
+    """
+    Bounded pool of worker threads shared by every session.
+
+    At most ``workers`` jobs run at once and at most ``max_queued`` more
+    wait for a worker; beyond that ``submit`` raises ``QueueFull`` so the
+    caller can ask the user to retry instead of piling up work. Finished
+    jobs are kept for ``keep_finished`` seconds so their results can be
+    polled on a later rerun.
+
+    Args:
+        workers: number of jobs running at the same time
+        max_queued: number of jobs allowed to wait for a worker
+        keep_finished: seconds a finished job stays available to ``get``
+    """
+
+    def __init__(self, workers=2, max_queued=8, keep_finished=600):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.keep_finished = keep_finished
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="qr-job")
+        self._jobs = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _run(self, job, func, args, kwargs):
+        job.status = "running"
+        # finished_at is set before the final status, so _prune never sees a finished job without it
+        try:
+            job.result = func(*args, progress=job.report, **kwargs)
+        except Exception as e:
+            job.error = e
+            job.finished_at = time.time()
+            job.status = "failed"
+        else:
+            job.finished_at = time.time()
+            job.status = "done"
+
+    def _prune(self, now):
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished and now - job.finished_at > self.keep_finished
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def pending(self):
+        """Number of jobs queued or running."""
+        with self._lock:
+            return sum(not job.finished for job in self._jobs.values())
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Run ``func(*args, progress=callback, **kwargs)`` on a worker.
+
+        Returns the ``Job``; raises ``QueueFull`` when the queue is at its limit.
+        """
+        with self._lock:
+            self._prune(time.time())
+            active = sum(not job.finished for job in self._jobs.values())
+            if active >= self.workers + self.max_queued:
+                raise QueueFull(f"{active} jobs already pending")
+            job = Job(str(next(self._ids)))
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, func, args, kwargs)
+        return job
+
+    def get(self, job_id):
+        """Return the job with ``job_id``, or None if it is unknown or expired."""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
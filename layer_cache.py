@@ -0,0 +1,137 @@
+import os
+import threading
+from collections import OrderedDict, namedtuple
+import numpy as np
+from PIL import Image, ImageSequence
+import metrics
+from result_cache import cache_key
+
+# A background decoded once: independent copies of its frames, their
+# source durations (0 where the file gives none), and the mode and loop
+# count of the file
+DecodedBackground = namedtuple("DecodedBackground", "frames durations mode size loop")
+
+
+def nbytes(value):
+    """Approximate memory held by a cached value: arrays, images and containers of them."""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, Image.Image):
+        return value.width * value.height * len(value.getbands())
+    if isinstance(value, (list, tuple)):
+        return sum(nbytes(item) for item in value)
+    return getattr(value, "nbytes", 0)
+
+
+class LayerCache:
+    """
+    Memory-bounded LRU cache of intermediate render results, by layer.
+
+    Entries are keyed by (layer, key); a layer's key includes the keys of
+    the layers it is built from (the background for resized frames, the
+    matrix for an overlay), so changing one input only misses the layers
+    downstream of it. Least recently used entries are evicted, across
+    layers, beyond ``max_bytes``; values larger than that are built but not
+    kept. Safe to share between threads; two threads missing the same key
+    at once both build it.
+
+    Args:
+        max_bytes: memory for cached values, see ``nbytes``
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # (layer, key) -> (nbytes, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def size(self):
+        """Bytes held by the cached values."""
+        return self._bytes
+
+    def fits(self, size):
+        """Whether a value of ``size`` bytes would be kept."""
+        return size <= self.max_bytes
+
+    def get(self, layer, key, build):
+        """
+        The value of ``layer`` for ``key``, calling ``build()`` to compute it on a miss.
+
+        Hits and misses are counted on the current metrics job as
+        ``cache_<layer>_hits`` and ``cache_<layer>_misses``.
+        """
+        with self._lock:
+            entry = self._entries.get((layer, key))
+            if entry is not None:
+                self._entries.move_to_end((layer, key))
+        if entry is not None:
+            metrics.count(f"cache_{layer}_hits")
+            return entry[1]
+        metrics.count(f"cache_{layer}_misses")
+        value = build()
+        size = nbytes(value)
+        if not self.fits(size):
+            return value
+        with self._lock:
+            previous = self._entries.pop((layer, key), None)
+            if previous is not None:
+                self._bytes -= previous[0]
+            self._entries[(layer, key)] = (size, value)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+        return value
+
+    def clear(self, layer=None):
+        """Drop every entry, or those of one layer."""
+        with self._lock:
+            for entry_key in [k for k in self._entries if layer is None or k[0] == layer]:
+                self._bytes -= self._entries.pop(entry_key)[0]
+
+
+# Shared by the layout functions: QR matrices and overlays are small and often reused
+DEFAULT_CACHE = LayerCache(max_bytes=64 * 1024 * 1024)
+
+
+def background_key(source):
+    """
+    Identity of a background for cache keys.
+
+    Paths are keyed by their resolved name, size and modification time;
+    seekable file objects by a hash of their whole content (their position
+    is kept).
+    """
+    if isinstance(source, (str, bytes)) or hasattr(source, "__fspath__"):
+        stat = os.stat(source)
+        return ("path", os.path.realpath(source), stat.st_size, stat.st_mtime_ns)
+    position = source.tell()
+    source.seek(0)
+    data = source.read()
+    source.seek(position)
+    return ("data", cache_key(data))
+
+
+def decode_background(image):
+    """Decode every frame of an opened background into a ``DecodedBackground``."""
+    frames = []
+    durations = []
+    for frame in ImageSequence.Iterator(image):
+        frames.append(frame.copy())
+        durations.append(frame.info.get("duration", 0))
+    image.seek(0)
+    return DecodedBackground(frames, durations, image.mode, image.size, image.info.get("loop", 0))
+
+
+def decoded_frames(cache, key, image):
+    """The ``frames`` layer: the opened background ``image`` decoded once per ``background_key``."""
+    return cache.get("frames", key, lambda: decode_background(image))
+
+
+def fits_decoded(cache, image):
+    """Whether the decoded frames of an opened background would stay in ``cache`` (estimated as RGBA)."""
+    return cache.fits(image.width * image.height * 4 * getattr(image, "n_frames", 1))
@@ -0,0 +1,416 @@
+import argparse
+import glob
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import requests
+import benchmark
+import check_memory
+import render_api
+from jobs import JobQueue, QueueFull
+from layer_cache import LayerCache
+from output_formats import get_format
+from result_cache import RENDERER_VERSION, ResultCache, cache_key
+
+# One request of a simulated user: when it started, in seconds from the
+# start of the run, how long it took, the corpus background it sent, and
+# its outcome: "ok", "degraded" (rendered in time by giving up quality,
+# see ``deadline.Deadline``) or "error", with the error message
+Sample = namedtuple("Sample", "start latency background status error")
+
+# Synthetic corpus of ``build_corpus``: (frames, width, height) of each
+# background, from a small sticker to a long full-screen clip
+DEFAULT_CORPUS = ((10, 160, 160), (30, 320, 320), (60, 480, 480), (120, 480, 270))
+
+# Latency percentiles reported
+PERCENTILES = (50, 95, 99)
+
+
+def build_corpus(workdir, specs=DEFAULT_CORPUS):
+    """Write synthetic GIF backgrounds into ``workdir``; returns [(name, bytes)]."""
+    corpus = []
+    for frames, width, height in specs:
+        path = os.path.join(workdir, f"bg_{frames}f_{width}x{height}.gif")
+        benchmark.synthetic_background(path, frames, (width, height))
+        with open(path, "rb") as f:
+            corpus.append((os.path.basename(path), f.read()))
+    return corpus
+
+
+def load_corpus(directory):
+    """The GIF backgrounds of ``directory``, as [(name, bytes)]."""
+    corpus = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.gif"))):
+        with open(path, "rb") as f:
+            corpus.append((os.path.basename(path), f.read()))
+    if not corpus:
+        raise ValueError(f"No GIF backgrounds in {directory}")
+    return corpus
+
+
+def _memory(pid):
+    # Proportional set size: pages shared between the processes (forked
+    # workers) are split between them instead of counted in each; RSS
+    # where the kernel does not report it
+    for path, field in ((f"/proc/{pid}/smaps_rollup", "Pss:"), (f"/proc/{pid}/status", "VmRSS:")):
+        try:
+            with open(path) as f:
+                for line in f:
+                    if line.startswith(field):
+                        return int(line.split()[1]) * 1024
+        except FileNotFoundError:
+            if not os.path.exists(f"/proc/{pid}"):
+                raise
+    return 0
+
+
+def process_memory(pid):
+    """Memory of process ``pid`` and all its descendants, in bytes (see ``_memory``); None without /proc."""
+    total = 0
+    pending = [pid]
+    try:
+        while pending:
+            current = pending.pop()
+            total += _memory(current)
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children") as children:
+                    pending.extend(int(child) for child in children.read().split())
+    except FileNotFoundError:
+        # A process exited while it was read; what was read is still the best sample
+        return total or None
+    except OSError:
+        return None
+    return total
+
+
+class MemorySampler(threading.Thread):
+    """
+    Sample the memory of a process tree (see ``process_memory``) every ``interval`` seconds, until ``stop``.
+
+    ``samples`` holds (seconds from start, bytes) pairs.
+    """
+
+    def __init__(self, pid, interval=0.5):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._stopped = threading.Event()
+        self._start_time = time.monotonic()
+
+    def run(self):
+        while not self._stopped.is_set():
+            rss = process_memory(self.pid)
+            if rss is not None:
+                self.samples.append((round(time.monotonic() - self._start_time, 3), rss))
+            self._stopped.wait(self.interval)
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+def render_target(pool, style, scale, output_format, time_budget=None):
+    """
+    A request function calling the render entry point on ``pool``, without HTTP.
+
+    Isolates the CPU cost of rendering: the same work as the app and the
+    render API, with ``pool`` playing their worker processes.
+    """
+    def call(url, background):
+        finish_by = time.time() + time_budget if time_budget is not None else None
+        _, degradations = pool.submit(render_api.render, url, background, style, scale, output_format,
+                                      finish_by).result()
+        return "degraded" if degradations else "ok", None
+    return call
+
+
+def app_target(queue, layer_cache, result_cache, scale, output_format, poll_interval=0.05):
+    """
+    A request function running the Streamlit app's render job on its ``jobs.JobQueue``, in this process.
+
+    Renders as ``app.start_generation`` does: ``app.render_to_cache`` on
+    the queue's threads, within ``app.RENDER_TIME_BUDGET``, with the shared
+    layer and result caches; a full queue is an error, as the app turns
+    users away. Only the UI of a ``streamlit run app.py`` process is left out.
+    """
+    import app  # Imports Streamlit, so only for this target
+
+    output_format = get_format(output_format)
+    scale = scale or 6
+
+    def call(url, background):
+        key = cache_key(background, url, scale, "black", None, output_format, RENDERER_VERSION)
+        try:
+            job = queue.submit(app.render_to_cache, result_cache, key, url, background, scale, "black", None,
+                               output_format, layer_cache)
+        except QueueFull as e:
+            return "error", f"Queue full: {e}"
+        while not job.finished:
+            time.sleep(poll_interval)
+        if job.status == "failed":
+            return "error", f"{type(job.error).__name__}: {job.error}"
+        _, degradations = job.result
+        return "degraded" if degradations else "ok", None
+    return call
+
+
+def http_target(base_url, style, scale, output_format, timeout=300):
+    """A request function posting to the render API at ``base_url``, one HTTP session per thread."""
+    local = threading.local()
+
+    def call(url, background):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        params = {"url": url, "style": style, "format": output_format}
+        if scale is not None:
+            params["scale"] = scale
+        response = local.session.post(f"{base_url}/render", params=params, data=background, timeout=timeout)
+        if response.status_code != 200:
+            return "error", f"HTTP {response.status_code}: {response.text[:200]}"
+        return "degraded" if response.headers.get("X-Degraded") else "ok", None
+    return call
+
+
+def run_load(call, corpus, users, duration, ramp_up=0.0, think_time=1.0, seed=0):
+    """
+    Run ``users`` simulated users against ``call`` for ``duration`` seconds.
+
+    Each user starts after its share of ``ramp_up``, then repeatedly picks
+    a random background from ``corpus``, sends it with a new URL (so no
+    result cache answers it), waits for the result, and thinks for an
+    exponentially distributed ``think_time`` on average. Requests still
+    running at the end are waited for.
+
+    Args:
+        call: request function, call(url, background bytes) -> (status, error message or None)
+        corpus: [(name, bytes)] backgrounds
+        users, duration, ramp_up, think_time: load shape, times in seconds
+        seed: seed of the users' random choices
+
+    Returns:
+        (list of ``Sample``, seconds from the start to the last answer)
+    """
+    samples = []
+    lock = threading.Lock()
+    start = time.monotonic()
+    end = start + duration
+
+    def user(index):
+        rng = random.Random(seed * 1000 + index)
+        time.sleep(ramp_up * index / max(users, 1))
+        request = 0
+        while time.monotonic() < end:
+            name, background = rng.choice(corpus)
+            url = f"https://example.com/load/{seed}/{index}/{request}"
+            request += 1
+            sent = time.monotonic()
+            try:
+                status, error = call(url, background)
+            except Exception as e:
+                status, error = "error", f"{type(e).__name__}: {e}"
+            answered = time.monotonic()
+            with lock:
+                samples.append(Sample(round(sent - start, 3), answered - sent, name, status, error))
+            if think_time:
+                time.sleep(rng.expovariate(1 / think_time))
+
+    threads = [threading.Thread(target=user, args=(index,), daemon=True) for index in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, time.monotonic() - start
+
+
+def latency_stats(latencies):
+    """Count, mean, max and ``PERCENTILES`` of latencies in seconds."""
+    if not latencies:
+        return {"count": 0}
+    values = np.percentile(latencies, PERCENTILES)
+    stats = {"count": len(latencies), "mean": round(float(np.mean(latencies)), 4),
+             "max": round(float(np.max(latencies)), 4)}
+    stats.update({f"p{p}": round(float(v), 4) for p, v in zip(PERCENTILES, values)})
+    return stats
+
+
+def summarize(samples, elapsed, memory=()):
+    """
+    The load test report: error rate, throughput and latency, overall and per background, and memory over time.
+
+    Latencies are of successful requests (degraded ones included).
+    """
+    ok = [sample for sample in samples if sample.status != "error"]
+    errors = [sample for sample in samples if sample.status == "error"]
+    messages = {}
+    for sample in errors:
+        messages[sample.error] = messages.get(sample.error, 0) + 1
+    per_background = {}
+    for name in sorted({sample.background for sample in samples}):
+        own = [sample for sample in samples if sample.background == name]
+        per_background[name] = {
+            "requests": len(own),
+            "errors": sum(sample.status == "error" for sample in own),
+            "latency": latency_stats([sample.latency for sample in own if sample.status != "error"]),
+        }
+    return {
+        "requests": len(samples),
+        "ok": sum(sample.status == "ok" for sample in samples),
+        "degraded": sum(sample.status == "degraded" for sample in samples),
+        "errors": len(errors),
+        "error_rate": round(len(errors) / len(samples), 4) if samples else None,
+        "error_messages": messages,
+        "elapsed": round(elapsed, 3),
+        "throughput": round(len(ok) / elapsed, 4) if elapsed else None,
+        "latency": latency_stats([sample.latency for sample in ok]),
+        "per_background": per_background,
+        "memory": {
+            "peak": max((rss for _, rss in memory), default=None),
+            "samples": [list(sample) for sample in memory],
+        },
+        "timeline": [[sample.start, round(sample.latency, 4), sample.status] for sample in samples],
+    }
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_api(workers, port=None, timeout=60):
+    """
+    Start ``render_api.py`` locally as a subprocess with ``workers`` render processes.
+
+    Returns (process, base URL) once ``/healthz`` answers.
+    """
+    port = port or free_port()
+    env = dict(os.environ, PORT=str(port), HOST="127.0.0.1", QR_API_WORKERS=str(workers),
+               QR_API_CACHE_DIR=tempfile.mkdtemp(prefix="qr_load_cache_"))
+    process = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                             "render_api.py")],
+                               env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"render_api.py exited with code {process.returncode}")
+        try:
+            if requests.get(f"{base_url}/healthz", timeout=1).status_code == 200:
+                return process, base_url
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"render_api.py did not answer on {base_url} within {timeout} s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate concurrent users rendering QR codes and report "
+                                                 "latency, throughput, errors and memory.")
+    parser.add_argument("--target", default="render",
+                        help='"render" to call the renderers directly on a local process pool, "app" to run the '
+                             'Streamlit app\'s render jobs on its thread queue in this process, "api" to start '
+                             'render_api.py locally, or the base URL of a running render API')
+    parser.add_argument("--users", type=int, default=4, help="concurrent simulated users")
+    parser.add_argument("--duration", type=float, default=60, help="seconds of load")
+    parser.add_argument("--ramp-up", type=float, default=5, help="seconds over which the users start")
+    parser.add_argument("--think-time", type=float, default=1.0, help="mean seconds between a user's requests")
+    parser.add_argument("--workers", type=int, default=render_api.DEFAULT_CONFIG.workers,
+                        help="render processes for the render and api targets, render threads for the app target")
+    parser.add_argument("--style", default="artistic", choices=render_api.RENDER_STYLES,
+                        help="render style; the app target always renders the artistic style")
+    parser.add_argument("--scale", type=int, default=None)
+    parser.add_argument("--format", default="gif", help="output format name")
+    parser.add_argument("--time-budget", type=float, default=None,
+                        help="seconds per render for the render target, degrading as the API does; "
+                             "the API target uses its own QR_API_TIMEOUT, the app target app.RENDER_TIME_BUDGET")
+    parser.add_argument("--corpus", default=None, help="directory of GIF backgrounds; synthetic ones if unset")
+    parser.add_argument("--pid", type=int, default=None, help="process whose memory to sample, for a URL target")
+    parser.add_argument("--interval", type=float, default=0.5, help="seconds between memory samples")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="load_test.json", help="JSON report path")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        corpus = load_corpus(args.corpus) if args.corpus else build_corpus(workdir)
+        pool = process = queue = None
+        try:
+            if args.target == "render":
+                pool = ProcessPoolExecutor(max_workers=args.workers)
+                call = render_target(pool, args.style, args.scale, args.format, args.time_budget)
+                pid = os.getpid()
+            elif args.target == "app":
+                import app
+                queue = JobQueue(workers=args.workers, max_queued=app.MAX_QUEUED_RENDERS)
+                call = app_target(queue, LayerCache(max_bytes=app.LAYER_CACHE_BYTES),
+                                  ResultCache(directory=os.path.join(workdir, "results")), args.scale, args.format)
+                pid = os.getpid()
+            elif args.target == "api":
+                process, base_url = start_api(args.workers)
+                call = http_target(base_url, args.style, args.scale, args.format)
+                pid = process.pid
+            else:
+                call = http_target(args.target.rstrip("/"), args.style, args.scale, args.format)
+                pid = args.pid
+            sampler = MemorySampler(pid, args.interval) if pid is not None else None
+            if sampler is not None:
+                sampler.start()
+            print(f"{args.users} users for {args.duration:g} s against {args.target}, "
+                  f"{len(corpus)} backgrounds...")
+            samples, elapsed = run_load(call, corpus, args.users, args.duration, args.ramp_up, args.think_time,
+                                        args.seed)
+            if sampler is not None:
+                sampler.stop()
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+            if queue is not None:
+                queue.shutdown()
+            if process is not None:
+                process.terminate()
+                process.wait()
+
+    report = summarize(samples, elapsed, sampler.samples if sampler is not None else ())
+    if args.target == "app":
+        # The renders ran in this process, as in the app's: its own high-water mark catches peaks between samples
+        report["memory"]["process_peak_rss"] = check_memory.max_rss()
+    report["config"] = {key: value for key, value in vars(args).items() if key != "output"}
+    report["environment"] = benchmark.environment()
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    latency = report["latency"]
+    if not report["requests"]:
+        print("No request was sent; lengthen --duration")
+        return 1
+    print(f"{report['requests']} requests in {report['elapsed']:.1f} s: {report['throughput']} renders/s, "
+          f"{report['error_rate']:.1%} errors, {report['degraded']} degraded")
+    if latency["count"]:
+        print("latency " + ", ".join(f"p{p} {latency[f'p{p}']:.2f} s" for p in PERCENTILES)
+              + f", max {latency['max']:.2f} s")
+    if report["memory"]["peak"] is not None:
+        print(f"peak memory {report['memory']['peak'] / 1024 ** 2:.0f} MB")
+    if "process_peak_rss" in report["memory"]:
+        print(f"process peak RSS {report['memory']['process_peak_rss'] / 1024 ** 2:.0f} MB")
+    for name, stats in report["per_background"].items():
+        own = stats["latency"]
+        p95 = f"p95 {own['p95']:.2f} s" if own["count"] else "no successes"
+        print(f"  {name}: {stats['requests']} requests, {stats['errors']} errors, {p95}")
+    for message, count in report["error_messages"].items():
+        print(f"  {count} x {message}")
+    print(f"Report saved as {args.output}")
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
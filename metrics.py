@@ -0,0 +1,348 @@
+import bisect
+import contextlib
+import contextvars
+import functools
+import itertools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger("qrcode_animado.metrics")
+
+# Histogram buckets in seconds, from a single frame step to a whole slow render
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_enabled = False
+_export_path = None
+_current = contextvars.ContextVar("qr_metrics_job", default=None)
+_job_ids = itertools.count(1)
+
+
+class Histogram:
+    """Cumulative-on-export histogram with a running sum and count."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _format_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in items
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class Registry:
+    """
+    Aggregated metrics of every finished job, safe to share between threads.
+
+    Counters and histograms are keyed by name and a sorted tuple of label
+    pairs, and ``render`` writes them in the Prometheus text format.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+
+    def describe(self, name, text):
+        self._help[name] = text
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def clear(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+            histograms = [(key, (h.buckets, list(h.counts), h.sum, h.count)) for key, h in histograms]
+
+        described = set()
+
+        def header(name, kind):
+            if name not in described:
+                described.add(name)
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            header(name, "counter")
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        for (name, labels), (buckets, counts, total, count) in histograms:
+            header(name, "histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(list(buckets) + ["+Inf"], counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+REGISTRY.describe("qr_renders_total", "Render jobs by renderer and status.")
+REGISTRY.describe("qr_render_seconds", "Wall time of a render job.")
+REGISTRY.describe("qr_render_stage_seconds", "Time a render job spent in each stage.")
+REGISTRY.describe("qr_render_frames_total", "Frames written by render jobs.")
+REGISTRY.describe("qr_render_pixels_total", "Pixels of the frames written by render jobs.")
+REGISTRY.describe("qr_render_bytes_out_total", "Bytes of GIF output written by render jobs.")
+
+
+class JobMetrics:
+    """Span timings and counters of one render job."""
+
+    def __init__(self, name, labels):
+        self.id = next(_job_ids)
+        self.name = name
+        self.labels = labels
+        self.status = "ok"
+        self.spans = defaultdict(float)
+        self.counters = defaultdict(int)
+        self.started = time.perf_counter()
+        self.duration = None
+
+
+class _Span:
+    __slots__ = ("job", "stage", "start")
+
+    def __init__(self, job, stage):
+        self.job = job
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.job.spans[self.stage] += time.perf_counter() - self.start
+
+
+_NULL_SPAN = contextlib.nullcontext()
+
+
+def enable(export_path=None):
+    """Turn instrumentation on; with ``export_path`` the Prometheus text is rewritten there after every job."""
+    global _enabled, _export_path
+    _enabled = True
+    _export_path = export_path
+
+
+def disable():
+    global _enabled, _export_path
+    _enabled = False
+    _export_path = None
+
+
+def is_enabled():
+    return _enabled
+
+
+def span(stage):
+    """
+    Time a stage of the current job: ``with metrics.span("resize"): ...``.
+
+    Returns a shared no-op context manager when instrumentation is off or
+    no job is running in this context, so the cost is one function call.
+    Stages run in worker processes (``workers > 1``) are not recorded.
+    """
+    if not _enabled:
+        return _NULL_SPAN
+    job = _current.get()
+    if job is None:
+        return _NULL_SPAN
+    return _Span(job, stage)
+
+
+def count(name, value=1):
+    """Add ``value`` to a counter of the current job."""
+    if _enabled:
+        job = _current.get()
+        if job is not None:
+            job.counters[name] += value
+
+
+def timed_iter(iterable, stage):
+    """Iterate ``iterable``, timing every step as ``stage`` of the current job; unchanged when off."""
+    if not _enabled:
+        return iterable
+    job = _current.get()
+    if job is None:
+        return iterable
+    return _timed_iter(iter(iterable), stage, job)
+
+
+def _timed_iter(iterator, stage, job):
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            job.spans[stage] += time.perf_counter() - start
+        yield item
+
+
+@contextlib.contextmanager
+def job(name, **labels):
+    """
+    Record one render job: spans and counters inside the block belong to it.
+
+    When the block ends the job is logged as one JSON line on the
+    ``qrcode_animado.metrics`` logger and added to ``REGISTRY``. Yields the
+    ``JobMetrics``, or None when instrumentation is off.
+    """
+    if not _enabled:
+        yield None
+        return
+    record = JobMetrics(name, labels)
+    token = _current.set(record)
+    try:
+        yield record
+    except BaseException:
+        record.status = "error"
+        raise
+    finally:
+        _current.reset(token)
+        _finish(record)
+
+
+def instrumented(name):
+    """
+    Decorator running a renderer as a metrics job named ``name``.
+
+    A False return value, the renderers' way of reporting a failure,
+    marks the job as an error.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with job(name) as record:
+                result = func(*args, **kwargs)
+                if result is False:
+                    record.status = "error"
+            return result
+        return wrapper
+    return decorator
+
+
+def _finish(record):
+    record.duration = time.perf_counter() - record.started
+    renderer = record.name
+    REGISTRY.inc("qr_renders_total", renderer=renderer, status=record.status)
+    REGISTRY.observe("qr_render_seconds", record.duration, renderer=renderer, status=record.status)
+    for stage, seconds in record.spans.items():
+        REGISTRY.observe("qr_render_stage_seconds", seconds, renderer=renderer, stage=stage)
+    for counter, metric in (("frames", "qr_render_frames_total"), ("pixels", "qr_render_pixels_total"),
+                            ("bytes_out", "qr_render_bytes_out_total")):
+        if counter in record.counters:
+            REGISTRY.inc(metric, record.counters[counter], renderer=renderer)
+
+    logger.info(json.dumps({
+        "event": "render",
+        "job": record.id,
+        "renderer": renderer,
+        "status": record.status,
+        "duration": round(record.duration, 6),
+        "spans": {stage: round(seconds, 6) for stage, seconds in record.spans.items()},
+        "counters": dict(record.counters),
+        **record.labels,
+    }))
+    if _export_path:
+        try:
+            write_prometheus(_export_path)
+        except OSError as e:
+            logger.warning("Could not write metrics to %s: %s", _export_path, e)
+
+
+def write_prometheus(path, registry=REGISTRY):
+    """Atomically write the metrics to ``path``, e.g. for node_exporter's textfile collector."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(registry.render())
+    os.replace(tmp_path, path)
+
+
+def start_http_server(port, host="127.0.0.1", registry=REGISTRY):
+    """Serve the metrics on ``http://host:port/metrics`` from a daemon thread; returns the server."""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="qr-metrics", daemon=True).start()
+    return server
+
+
+def configure_from_env(environ=None):
+    """
+    Set up instrumentation from environment variables; returns whether it is on.
+
+    ``QR_METRICS=1`` turns it on and logs jobs to stderr unless logging is
+    already configured, ``QR_METRICS_FILE`` names a file to keep the
+    Prometheus text in, and ``QR_METRICS_PORT`` serves it on localhost.
+    Either export variable turns metrics on as well.
+    """
+    environ = os.environ if environ is None else environ
+    path = environ.get("QR_METRICS_FILE") or None
+    port = environ.get("QR_METRICS_PORT")
+    if environ.get("QR_METRICS", "").lower() not in ("1", "true", "yes", "on") and not path and not port:
+        return False
+    enable(path)
+    if not logger.handlers and not logging.getLogger().handlers:
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+    if port:
+        start_http_server(int(port), environ.get("QR_METRICS_HOST", "127.0.0.1"))
+    return True
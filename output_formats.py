@@ -0,0 +1,118 @@
+import os
+from collections import namedtuple
+import numpy as np
+import metrics
+from gif_writer import GifWriter, rgba_array
+
+# An animated output format. ``pillow_format`` is what ``Image.save`` is
+# given; ``quality`` (0-100) and ``method`` (WebP effort 0-6, PNG
+# compress level 0-9) are encoder settings, None where the format has none.
+# For lossless WebP, ``quality`` is the compression effort.
+OutputFormat = namedtuple("OutputFormat", "name pillow_format extension mime lossless quality method")
+
+FORMATS = {
+    "gif": OutputFormat("gif", "GIF", ".gif", "image/gif", lossless=False, quality=None, method=None),
+    "webp": OutputFormat("webp", "WEBP", ".webp", "image/webp", lossless=False, quality=80, method=4),
+    "webp_lossless": OutputFormat("webp_lossless", "WEBP", ".webp", "image/webp", lossless=True, quality=80, method=4),
+    "apng": OutputFormat("apng", "PNG", ".png", "image/apng", lossless=True, quality=None, method=6),
+}
+
+
+def get_format(output_format, **overrides):
+    """An ``OutputFormat`` from its name in ``FORMATS`` (or an ``OutputFormat``), with fields replaced by ``overrides``."""
+    if isinstance(output_format, str):
+        if output_format not in FORMATS:
+            raise ValueError(f"Unknown output format {output_format!r}, expected one of {', '.join(FORMATS)}")
+        output_format = FORMATS[output_format]
+    overrides = {field: value for field, value in overrides.items() if value is not None}
+    return output_format._replace(**overrides) if overrides else output_format
+
+
+class AnimationWriter:
+    """
+    Write frames to an animated WebP or APNG with Pillow, like ``GifWriter`` does for GIF.
+
+    Pillow encodes these formats from the whole frame list, so frames are
+    kept (at output size, in RGBA) until ``close``; a frame identical to
+    the previous one only extends its duration. Frames are full colour:
+    there is no palette and no quantization.
+
+    Args:
+        target: filename or writable binary file object
+        output_format: an ``OutputFormat`` or a name from ``FORMATS``, other than GIF
+        duration: default frame duration in milliseconds
+        loop: number of loops, 0 loops forever, None plays once
+    """
+
+    def __init__(self, target, output_format="webp", duration=50, loop=0):
+        self.format = get_format(output_format)
+        if self.format.pillow_format == "GIF":
+            raise ValueError("Use GifWriter for GIF output")
+        self.target = target
+        self.duration = duration
+        self.loop = 1 if loop is None else loop  # None plays once, as in GifWriter
+        self.frames = []
+        self.durations = []
+        self._previous = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+
+    def write(self, frame, duration=None):
+        """Add ``frame`` to the animation, shown for ``duration`` milliseconds."""
+        if duration is None:
+            duration = self.duration
+        metrics.count("frames")
+        metrics.count("pixels", frame.width * frame.height)
+        rgba = rgba_array(frame)
+        if self._previous is not None and np.array_equal(self._previous, rgba):
+            self.durations[-1] += duration
+            return
+        self.frames.append(frame if frame.mode == "RGBA" else frame.convert("RGBA"))
+        self.durations.append(duration)
+        self._previous = rgba
+
+    def _save_options(self):
+        output_format = self.format
+        options = {"duration": self.durations, "loop": self.loop}
+        if output_format.pillow_format == "WEBP":
+            # Pillow would take the canvas colour from the first frame's info, e.g. a GIF background index
+            options.update(lossless=output_format.lossless, quality=output_format.quality,
+                           method=output_format.method, background=(0, 0, 0, 0))
+        elif output_format.method is not None:
+            options["compress_level"] = output_format.method
+        return options
+
+    def close(self):
+        """Encode and save the animation."""
+        if not self.frames:
+            raise ValueError("No frames to write")
+        is_file = hasattr(self.target, "write")
+        start = self.target.tell() if is_file else 0
+        with metrics.span("encode"):
+            self.frames[0].save(self.target, self.format.pillow_format, save_all=True,
+                                append_images=self.frames[1:], **self._save_options())
+        if metrics.is_enabled():
+            metrics.count("bytes_out", self.target.tell() - start if is_file else os.path.getsize(self.target))
+        self.frames = []
+
+
+def open_writer(target, output_format="gif", loop=0, palette=None, workers=1):
+    """
+    A ``GifWriter`` or ``AnimationWriter`` for ``output_format``.
+
+    Args:
+        target: filename or writable binary file object
+        output_format: an ``OutputFormat`` or a name from ``FORMATS``
+        loop: number of loops, 0 loops forever, None plays once
+        palette: global color table for GIF output (see ``GifWriter``)
+        workers: processes encoding GIF frames (see ``GifWriter``); other formats encode here
+    """
+    output_format = get_format(output_format)
+    if output_format.pillow_format == "GIF":
+        return GifWriter(target, loop=loop, palette=palette, workers=workers)
+    return AnimationWriter(target, output_format, loop=loop)
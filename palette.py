@@ -0,0 +1,174 @@
+import numpy as np
+from PIL import Image
+
+try:
+    from PIL.Image import Dither
+    NO_DITHER = Dither.NONE
+except ImportError:
+    from PIL.Image import NONE as NO_DITHER
+
+# Colours every QR palette keeps exactly, so modules never drift to a near-black or near-white
+RESERVED_COLORS = ((0, 0, 0), (255, 255, 255))
+
+# Index of the transparent entry in every GlobalPalette
+TRANSPARENT_INDEX = 255
+
+# Pixels fed to the quantizer at most; its cost grows with the number of distinct colours
+MAX_PALETTE_PIXELS = 1 << 16
+
+
+def is_opaque(frame):
+    """Whether ``frame`` has no transparent or translucent pixel."""
+    if frame.mode in ("RGBA", "LA", "PA"):
+        return frame.getchannel("A").getextrema()[0] == 255
+    return "transparency" not in frame.info
+
+
+class GlobalPalette:
+    """
+    One palette shared by every frame of an animation.
+
+    Holds up to 255 colours; the last entry is reserved for transparency.
+    Frames are mapped onto it with a fixed nearest-colour lookup instead of
+    being quantized one by one, so colours do not flicker between frames
+    and the GIF can store the palette once as its global color table.
+
+    Args:
+        colors: sequence of (r, g, b) tuples, duplicates are dropped
+    """
+
+    transparent = TRANSPARENT_INDEX
+
+    def __init__(self, colors):
+        colors = list(dict.fromkeys(tuple(int(c) for c in color) for color in colors))
+        if not colors or len(colors) > TRANSPARENT_INDEX:
+            raise ValueError(f"A palette needs 1 to {TRANSPARENT_INDEX} colors, got {len(colors)}")
+        self.colors = np.array(colors, dtype=np.uint8)
+        # Unused entries repeat the first colour; lookups fold them back onto it
+        table = np.empty((256, 3), dtype=np.uint8)
+        table[:] = self.colors[0]
+        table[:len(colors)] = self.colors
+        self.table = table
+        self._canonical = np.zeros(256, dtype=np.uint8)
+        self._canonical[:len(colors)] = np.arange(len(colors))
+        self._image = Image.new("P", (1, 1))
+        self._image.putpalette(table.tobytes())
+
+    def __len__(self):
+        return len(self.colors)
+
+    def palette_bytes(self):
+        """The 256-entry palette as 768 RGB bytes, transparent entry included."""
+        return self.table.tobytes()
+
+    def index(self, color):
+        """Index of the palette colour nearest to ``color`` (r, g, b)."""
+        return int(self.nearest(np.asarray(color)[None])[0])
+
+    def nearest(self, colors):
+        """Indices of the palette colours nearest to an (N, 3) array of colours."""
+        colors = np.asarray(colors, dtype=np.int32)
+        distances = ((colors[:, None, :] - self.colors[None, :, :].astype(np.int32)) ** 2).sum(axis=2)
+        return distances.argmin(axis=1).astype(np.uint8)
+
+    def quantize(self, image):
+        """
+        Map an image onto the palette without dithering.
+
+        Returns a (height, width) uint8 array of indices; fully transparent
+        pixels get the transparent index.
+        """
+        rgb = image if image.mode == "RGB" else image.convert("RGB")
+        indices = self._canonical[np.asarray(rgb.quantize(palette=self._image, dither=NO_DITHER))]
+        if image.mode in ("RGBA", "LA") or "transparency" in image.info:
+            alpha = image if image.mode in ("RGBA", "LA") else image.convert("RGBA")
+            indices[np.asarray(alpha.getchannel("A")) == 0] = self.transparent
+        return indices
+
+    def to_image(self, indices):
+        """Wrap an array of indices as a ``P`` image using this palette."""
+        image = Image.fromarray(indices, "P")
+        image.putpalette(self.palette_bytes())
+        image.info["transparency"] = self.transparent
+        return image
+
+
+class IndexedOverlay:
+    """
+    An RGBA overlay compiled against a ``GlobalPalette`` for compositing in ``P`` mode.
+
+    Every distinct overlay colour becomes a class, and ``lut[c, i]`` holds
+    the palette index of overlay colour ``c`` alpha-composited over palette
+    entry ``i``. Compositing a frame is then one table lookup per visible
+    overlay pixel, with no RGBA round trip and no requantization.
+
+    Args:
+        overlay: RGBA image, the same size as the frames
+        palette: the ``GlobalPalette`` of the animation
+    """
+
+    def __init__(self, overlay, palette):
+        pixels = np.ascontiguousarray(overlay.convert("RGBA")).view(np.uint32).ravel()
+        colors, classes = np.unique(pixels, return_inverse=True)
+        colors = colors.view(np.uint8).reshape(-1, 4)
+        self.classes = classes.reshape(overlay.size[1], overlay.size[0]).astype(np.uint8 if len(colors) <= 256 else np.uint16)
+        self.palette = palette
+        # Fully transparent overlay pixels map every palette index to itself; skip them
+        self.visible = np.flatnonzero(colors[classes.ravel(), 3])
+        self._visible_classes = self.classes.ravel()[self.visible]
+
+        # Same formula as Image.alpha_composite, for every overlay colour over every palette entry
+        over = colors[:, None, :3].astype(np.float64)
+        over_alpha = colors[:, None, 3:].astype(np.float64) / 255
+        under = palette.table[None, :, :].astype(np.float64)
+        under_alpha = np.full((1, 256, 1), 1.0)
+        under_alpha[0, palette.transparent] = 0
+        alpha = over_alpha + under_alpha * (1 - over_alpha)
+        blended = (over * over_alpha + under * under_alpha * (1 - over_alpha)) / np.maximum(alpha, 1e-9)
+        lut = palette.nearest(np.rint(blended).reshape(-1, 3)).reshape(len(colors), 256)
+        lut[alpha[..., 0] == 0] = palette.transparent
+        self.lut = lut
+
+    def composite(self, indices):
+        """Composite the overlay over an array of palette indices; returns a ``P`` image."""
+        indices = np.array(indices)
+        pixels = indices.reshape(-1)
+        pixels[self.visible] = self.lut[self._visible_classes, pixels[self.visible]]
+        return self.palette.to_image(indices)
+
+
+def build_palette(frames, colors=256, reserved=RESERVED_COLORS):
+    """
+    Build one palette for a whole animation from a sample of its frames.
+
+    The opaque pixels of all sampled frames (evenly thinned out to
+    ``MAX_PALETTE_PIXELS``) are quantized together with Pillow's fast
+    octree, leaving room for the ``reserved`` colours (added exactly) and
+    the transparent entry.
+
+    Args:
+        frames: iterable of sample frames, ideally at output size
+        colors: total palette size, transparent entry included (at most 256)
+        reserved: (r, g, b) colours the palette must contain exactly
+
+    Returns:
+        A ``GlobalPalette``
+    """
+    reserved = [tuple(color) for color in reserved]
+    budget = min(colors, 256) - 1 - len(reserved)
+    pixels = []
+    for frame in frames:
+        rgba = np.asarray(frame.convert("RGBA")).reshape(-1, 4)
+        pixels.append(rgba[rgba[:, 3] != 0, :3])
+    pixels = np.concatenate(pixels) if pixels else np.empty((0, 3), dtype=np.uint8)
+    if len(pixels) > MAX_PALETTE_PIXELS:
+        pixels = pixels[np.linspace(0, len(pixels) - 1, MAX_PALETTE_PIXELS).astype(np.intp)]
+
+    sampled = []
+    if budget > 0 and len(pixels):
+        # Any shape will do for the quantizer; one pixel row keeps it simple
+        strip = Image.fromarray(np.ascontiguousarray(pixels[None]), "RGB")
+        quantized = strip.quantize(colors=budget, method=Image.Quantize.FASTOCTREE, dither=NO_DITHER)
+        used = np.unique(np.asarray(quantized))
+        sampled = [tuple(color) for color in np.array(quantized.getpalette()[:768]).reshape(-1, 3)[used]]
+    return GlobalPalette(reserved + sampled)
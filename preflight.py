@@ -0,0 +1,198 @@
+from collections import namedtuple
+from itertools import islice
+import numpy as np
+from PIL import ImageSequence
+from gif_writer import rgba_array
+from ingest import DEFAULT_LIMITS, open_background
+from qr_mask import finder_mask
+
+# Lowest symbol contrast accepted by default, as a fraction of the 0-255
+# range: grade C of the ISO/IEC 15415 symbol contrast scale
+MIN_CONTRAST = 0.4
+
+# Fraction of data modules allowed below the contrast in a frame; error
+# correction absorbs a few misread modules, so single outliers do not count
+TOLERANCE = 0.02
+
+# Outcome of a pre-flight check. ``contrast`` is the per-frame contrast
+# with ``dark_opacity`` and ``light_opacity`` (0-255, the alpha of the dots
+# over dark and light data modules), ``worst_frame`` the frame where it is
+# lowest, and ``min_contrast`` the target (None if only measured).
+ScanReport = namedtuple("ScanReport", "contrast worst_frame dark_opacity light_opacity min_contrast")
+
+
+def module_luminance(background, module_count, place, limits=DEFAULT_LIMITS, frames=None):
+    """
+    Background luminance under every module centre, for every frame.
+
+    Each frame is sampled, nearest pixel, where the render puts it (resized
+    to ``place.frame_size`` at ``place.offset``) and composited over white;
+    centres outside the frame see the white canvas.
+
+    Args:
+        background: path or file object of the background animation
+        module_count: modules on a side of the code
+        place: the ``qr_style.Placement`` of the code
+        limits: ``ingest.IngestLimits`` checked before decoding
+        frames: sample only this many leading frames (1 for still renders), None for all
+
+    Returns:
+        (frames, module_count, module_count) float32 array, 0-255
+    """
+    bg = open_background(background, limits)
+    width, height = bg.size
+    centres = place.origin + np.arange(module_count) * place.module_size + place.module_size // 2
+    position = centres - place.offset
+    inside = (position >= 0) & (position < place.frame_size)
+    xs = np.clip(((position + 0.5) * width / place.frame_size).astype(int), 0, width - 1)
+    ys = np.clip(((position + 0.5) * height / place.frame_size).astype(int), 0, height - 1)
+
+    samples = np.stack([rgba_array(frame)[ys[:, None], xs[None, :]] for frame in islice(ImageSequence.Iterator(bg), frames)])
+    alpha = samples[..., 3:].astype(np.float32) / 255
+    rgb = samples[..., :3] * alpha + 255 * (1 - alpha)
+    luminance = rgb @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    luminance[:, ~inside, :] = 255
+    luminance[:, :, ~inside] = 255
+    return luminance
+
+
+def contrast_bounds(luminance, matrix, tolerance=TOLERANCE):
+    """
+    Per-frame luminance bounds of the data modules: the brightest dark and darkest light ones.
+
+    Outliers up to ``tolerance`` of the modules are ignored. Rendered
+    luminance only grows with the background's, so these bounds give the
+    worst-case contrast for any dot opacity (see ``frame_contrast``).
+
+    Returns:
+        (dark_high, light_low) arrays of one value per frame
+    """
+    matrix = np.asarray(matrix, dtype=bool)
+    data = ~finder_mask(len(matrix))
+    dark_high = np.quantile(luminance[:, matrix & data], 1 - tolerance, axis=1)
+    light_low = np.quantile(luminance[:, ~matrix & data], tolerance, axis=1)
+    return dark_high, light_low
+
+
+def frame_contrast(dark_high, light_low, dark_opacity, light_opacity):
+    """
+    Worst-case contrast of every frame, 0-1, with black and white dots of the given opacities (0-255).
+
+    A black dot of opacity a leaves ``L * (1 - a)`` of the background
+    luminance L, a white one moves it to ``L + (255 - L) * b``.
+    """
+    a = np.asarray(dark_opacity, dtype=np.float64) / 255
+    b = np.asarray(light_opacity, dtype=np.float64) / 255
+    return (light_low + (255 - light_low) * b - dark_high * (1 - a)) / 255
+
+
+def choose_opacities(dark_high, light_low, min_contrast=MIN_CONTRAST, dark=(0, 255), light=(0, 255)):
+    """
+    The lightest dots that keep every frame at ``min_contrast``.
+
+    White dots on light modules change the look most, so their opacity is
+    kept as low as possible; the black dot opacity is then the lowest that
+    reaches the target on every frame. Every candidate is evaluated at once.
+    When no opacities in range reach the target, the darkest are returned.
+
+    Args:
+        dark_high, light_low: see ``contrast_bounds``
+        min_contrast: target contrast, 0-1
+        dark, light: (lowest, highest) opacity allowed for each dot, 0-255
+
+    Returns:
+        (dark_opacity, light_opacity), 0-255
+    """
+    lights = np.arange(light[0], light[1] + 1)
+    b = lights[:, None] / 255
+    # Dark opacity each frame needs, for every light opacity: light_low + (255 - light_low) b - dark_high (1 - a) >= 255 c
+    margin = light_low + (255 - light_low) * b - 255 * min_contrast
+    with np.errstate(divide="ignore", invalid="ignore"):
+        needed = np.where(dark_high > 0, 1 - margin / dark_high, np.where(margin >= 0, 0.0, np.inf))
+    needed = np.ceil(np.clip(needed.max(axis=1), 0, None) * 255 - 1e-9)
+    feasible = np.flatnonzero(needed <= dark[1])
+    index = int(feasible[0]) if len(feasible) else len(lights) - 1
+    return int(np.clip(needed[index], *dark)), int(lights[index])
+
+
+def opacity_range(fill):
+    """
+    The (lowest, highest) opacity the tuning may give a dot fill.
+
+    An absent fill stays absent and a solid one stays solid, as part of the
+    look; only semi-transparent fills are tuned, over the whole range.
+    """
+    if fill is None:
+        return (0, 0)
+    return (255, 255) if fill[3] == 255 else (0, 255)
+
+
+def tunable(style):
+    """Whether tuning can change any dot of ``style``: it needs a semi-transparent fill (see ``opacity_range``)."""
+    return any(low < high for low, high in (opacity_range(style.dark), opacity_range(style.light)))
+
+
+def check(background, matrix, style, place, min_contrast=None, tolerance=TOLERANCE, limits=DEFAULT_LIMITS,
+          frames=None):
+    """
+    Measure, or tune, the contrast of a styled code over every frame of a background.
+
+    With ``min_contrast`` the report carries the lightest dot opacities that
+    reach it (see ``choose_opacities``) within the ``opacity_range`` of
+    the style's fills, otherwise those of ``style``.
+
+    Args:
+        background: path or file object of the background animation
+        matrix: the QR matrix, as a boolean array
+        style: the ``qr_style.QRStyle``
+        place: its ``qr_style.Placement`` for this matrix
+        min_contrast: target contrast, 0-1, or None to only measure
+        tolerance: see ``contrast_bounds``
+        limits: ``ingest.IngestLimits`` checked before decoding
+        frames: see ``module_luminance``
+
+    Returns:
+        A ``ScanReport``
+
+    Raises:
+        ValueError: with ``min_contrast``, when the style is not ``tunable``
+    """
+    if min_contrast is not None and not tunable(style):
+        raise ValueError("min_contrast cannot change this style: its dots are solid or absent, "
+                         "and only semi-transparent dots are tuned")
+    luminance = module_luminance(background, len(matrix), place, limits, frames)
+    if hasattr(background, "seek"):
+        background.seek(0)
+    dark_high, light_low = contrast_bounds(luminance, matrix, tolerance)
+    if min_contrast is None:
+        dark_opacity = style.dark[3] if style.dark is not None else 0
+        light_opacity = style.light[3] if style.light is not None else 0
+    else:
+        dark_opacity, light_opacity = choose_opacities(dark_high, light_low, min_contrast,
+                                                       opacity_range(style.dark), opacity_range(style.light))
+    contrast = frame_contrast(dark_high, light_low, dark_opacity, light_opacity)
+    return ScanReport(contrast, int(np.argmin(contrast)), dark_opacity, light_opacity, min_contrast)
+
+
+def summary(report):
+    """One line describing a ``ScanReport``, for the renderers to print."""
+    worst = report.contrast[report.worst_frame]
+    text = (f"dark dot opacity {report.dark_opacity}, light dot opacity {report.light_opacity}, "
+            f"worst contrast {worst:.2f} in frame {report.worst_frame}")
+    if report.min_contrast is not None and worst < report.min_contrast:
+        text += f", below {report.min_contrast:.2f} even with the darkest dots allowed"
+    return text
+
+
+def tuned_style(style, report):
+    """
+    ``style`` with the dot opacities of a ``ScanReport``.
+
+    Only the dots the style draws are tuned: a style without light (or
+    dark) dots gets none (see ``opacity_range``). Finder patterns drawn as plain modules (no halo)
+    in the dot colour are tuned with the dots; haloed finders keep their fill.
+    """
+    dark = None if style.dark is None else tuple(style.dark[:3]) + (report.dark_opacity,)
+    light = None if style.light is None else tuple(style.light[:3]) + (report.light_opacity,)
+    finder = dark if style.finder_halo is None and style.finder == style.dark and dark is not None else style.finder
+    return style._replace(dark=dark, light=light, finder=finder)
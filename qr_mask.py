@@ -0,0 +1,16 @@
+from collections import namedtuple
+import numpy as np
+
+# Where a renderer puts the QR code: background frames are resized to
+# frame_size and pasted at offset on a canvas of size size filled with the
+# RGBA base colour, then covered by the RGBA overlay. Depends on the URL,
+# never on the background.
+OverlayLayout = namedtuple("OverlayLayout", "size frame_size offset overlay base")
+
+
+def finder_mask(module_count):
+    """Boolean (module_count, module_count) array marking the three finder patterns."""
+    idx = np.arange(module_count)
+    near = idx < 7
+    far = idx >= module_count - 7
+    return (near[:, None] & near[None, :]) | (far[:, None] & near[None, :]) | (near[:, None] & far[None, :])
@@ -0,0 +1,568 @@
+from collections import namedtuple
+from functools import partial
+import numpy as np
+import segno
+from PIL import Image
+import metrics
+import preflight
+from deadline import CostModel, RenderPlan, Resampling, estimate, scale_steps
+from frame_pool import MIN_PARALLEL_FRAMES, map_timed_batches, resolve_workers, sample_frames, sample_indices
+from frame_store import apply_stored, decode_frames
+from ingest import DEFAULT_LIMITS, open_background, shrink_frame
+from layer_cache import DEFAULT_CACHE, background_key, decoded_frames, fits_decoded
+from output_formats import get_format, open_writer
+from palette import IndexedOverlay, build_palette, is_opaque
+from qr_mask import OverlayLayout, finder_mask
+from timing import DEFAULT_DURATION, DUPLICATE_THRESHOLD, iter_timed_frames, retime_frames
+
+# A declarative module style for the overlay renderers.
+#
+# Sizing: with ``fit`` the code and its quiet zone are scaled to fit a
+# fit x fit canvas less FIT_BORDER pixels on each side, otherwise modules
+# are ``scale`` pixels and the canvas adds ``margin`` modules around the
+# quiet zone. ``frame`` is where the background goes: "quiet_zone" behind
+# the code and its quiet zone on the ``base`` canvas, or the whole "canvas".
+#
+# Drawing: finder modules are a ``finder`` RGBA square with a white halo of
+# ``finder_halo`` pixels (None for none); with ``finder_light`` light finder
+# modules are drawn the same way. Data modules get a dot inset by
+# ``dot_padding`` of the module, or ``dot_size`` of the module wide and
+# centred; dark dots get a white halo of ``dot_halo`` pixels. ``dark`` and
+# ``light`` are the RGBA fills of the dots, None for no dot. ``base`` is the
+# RGBA fill of the canvas around a "quiet_zone" frame; GIF has no partial
+# transparency and shows it opaque.
+QRStyle = namedtuple(
+    "QRStyle",
+    "error fit quiet_zone margin frame finder finder_halo finder_light dot_padding dot_size dot_halo dark light base",
+)
+
+FIT_BORDER = 10
+
+WHITE = (255, 255, 255, 255)
+BLACK = (0, 0, 0, 255)
+
+STYLES = {
+    # working_qr: small black dots with a thin white halo, 300px
+    "styled": QRStyle(error='h', fit=300, quiet_zone=2, margin=0, frame="quiet_zone",
+                      finder=BLACK, finder_halo=2, finder_light=False,
+                      dot_padding=0.3, dot_size=None, dot_halo=1, dark=BLACK, light=None, base=WHITE),
+    # pil_qr_creator: medium error correction, larger dots, bolder finder halo, slightly see-through base
+    "pil": QRStyle(error='m', fit=300, quiet_zone=2, margin=0, frame="quiet_zone",
+                   finder=BLACK, finder_halo=3, finder_light=False,
+                   dot_padding=0.35, dot_size=None, dot_halo=1, dark=BLACK, light=None,
+                   base=(255, 255, 255, 220)),
+    # basic_qr: centred dots on every module, faint white ones on light modules
+    "basic": QRStyle(error='h', fit=None, quiet_zone=4, margin=2, frame="canvas",
+                     finder=BLACK, finder_halo=4, finder_light=True,
+                     dot_padding=None, dot_size=0.3, dot_halo=None, dark=BLACK, light=(255, 255, 255, 30),
+                     base=WHITE),
+    # pil_qr_creator's static image: whole semi-transparent modules
+    "static": QRStyle(error='h', fit=None, quiet_zone=4, margin=0, frame="canvas",
+                      finder=(0, 0, 0, 128), finder_halo=None, finder_light=False,
+                      dot_padding=0, dot_size=None, dot_halo=None, dark=(0, 0, 0, 128), light=None,
+                      base=WHITE),
+}
+
+# Where the modules go, in pixels: ``module_size`` per module from
+# ``origin`` (x = y) on a ``size`` x ``size`` canvas, with the background
+# frame resized to ``frame_size`` at ``offset``
+Placement = namedtuple("Placement", "module_size origin size frame_size offset")
+
+# Module classes of ``ModuleGeometry.classes``
+LIGHT, DARK, FINDER_LIGHT, FINDER_DARK = range(4)
+
+# Per-matrix geometry of a style: ``classes`` is the (n, n) uint8 class of
+# every module, and class c draws ``layers[c]`` rectangles, ``boxes[c, i]``
+# (inclusive x0, y0, x1, y1 relative to the module's top-left pixel) filled
+# with ``fills[c, i]``, in order.
+ModuleGeometry = namedtuple("ModuleGeometry", "classes layers boxes fills")
+
+
+def get_style(style, **overrides):
+    """A ``QRStyle`` from its name in ``STYLES`` (or a ``QRStyle``), with fields replaced by ``overrides``."""
+    if isinstance(style, str):
+        if style not in STYLES:
+            raise ValueError(f"Unknown style {style!r}, expected one of {', '.join(STYLES)}")
+        style = STYLES[style]
+    return style._replace(**overrides) if overrides else style
+
+
+def _module_layers(style, module_size, module_class):
+    m = module_size
+    if module_class in (FINDER_DARK, FINDER_LIGHT):
+        if module_class == FINDER_LIGHT and not style.finder_light:
+            return []
+        layers = []
+        if style.finder_halo is not None:
+            h = style.finder_halo
+            layers.append(((-h, -h, m + h, m + h), WHITE))
+        layers.append(((0, 0, m, m), style.finder))
+        return layers
+
+    fill = style.dark if module_class == DARK else style.light
+    if fill is None:
+        return []
+    if style.dot_size is not None:
+        size = int(m * style.dot_size)
+        start = (m - size) // 2
+        dot = (start, start, start + size, start + size)
+    else:
+        padding = int(m * style.dot_padding)
+        dot = (padding, padding, m - padding, m - padding)
+    layers = []
+    if style.dot_halo is not None and module_class == DARK:
+        h = style.dot_halo
+        layers.append(((dot[0] - h, dot[1] - h, dot[2] + h, dot[3] + h), WHITE))
+    layers.append((dot, fill))
+    return layers
+
+
+def module_geometry(matrix, style, module_size):
+    """Compute the ``ModuleGeometry`` of ``style`` for a QR matrix (array or rows of modules)."""
+    dark = np.asarray(matrix, dtype=bool)
+    classes = np.where(dark, DARK, LIGHT).astype(np.uint8)
+    classes[finder_mask(len(dark))] += FINDER_LIGHT
+    per_class = [_module_layers(style, module_size, module_class) for module_class in range(4)]
+    depth = max(len(layers) for layers in per_class)
+    boxes = np.zeros((4, depth, 4), dtype=np.int32)
+    fills = np.zeros((4, depth, 4), dtype=np.uint8)
+    for module_class, layers in enumerate(per_class):
+        for index, (box, fill) in enumerate(layers):
+            boxes[module_class, index] = box
+            fills[module_class, index] = fill
+    layers = np.array([len(layers) for layers in per_class], dtype=np.int32)
+    return ModuleGeometry(classes, layers, boxes, fills)
+
+
+def rasterize_geometry(geometry, size, module_size, origin):
+    """
+    Draw a ``ModuleGeometry`` into an RGBA overlay array.
+
+    The result is what drawing every module's rectangles row by row with
+    ``ImageDraw.rectangle`` would give (later rectangles overwrite earlier
+    ones), computed one rectangle shape at a time over all modules that
+    use it: each pixel takes the fill of the last rectangle covering it.
+
+    Args:
+        geometry: the ``ModuleGeometry``
+        size: (width, height) of the overlay
+        module_size: pixels per module
+        origin: (x, y) pixel position of module (0, 0)
+
+    Returns:
+        The overlay as a (height, width, 4) uint8 array
+    """
+    width, height = size
+    classes = geometry.classes.ravel()
+    count = len(geometry.classes)
+    depth = geometry.boxes.shape[1]
+    rows, cols = np.divmod(np.arange(classes.size, dtype=np.int32), count)
+    left = cols * module_size + origin[0]
+    top = rows * module_size + origin[1]
+
+    # Draw order of a rectangle: module index in row-major order, then layer
+    last = np.full(width * height, -1, dtype=np.int32)
+    for module_class in range(4):
+        modules = np.flatnonzero(classes == module_class).astype(np.int32)
+        for layer in range(geometry.layers[module_class] if len(modules) else 0):
+            x0, y0, x1, y1 = geometry.boxes[module_class, layer]
+            dy, dx = np.mgrid[y0:y1 + 1, x0:x1 + 1].astype(np.int32)
+            xs = left[modules, None] + dx.ravel()
+            ys = top[modules, None] + dy.ravel()
+            order = np.broadcast_to((modules * depth + layer)[:, None], xs.shape)
+            inside = (xs >= 0) & (xs < width) & (ys >= 0) & (ys < height)
+            np.maximum.at(last, (ys * width + xs)[inside], order[inside])
+
+    # Fill of every draw order, as packed RGBA
+    fills = geometry.fills.reshape(-1, 4).copy().view(np.uint32).ravel()
+    fill_of = fills[(classes[:, None].astype(np.int32) * depth + np.arange(depth, dtype=np.int32)).ravel()]
+    overlay = np.zeros(width * height, dtype=np.uint32)
+    drawn = np.flatnonzero(last >= 0)
+    overlay[drawn] = fill_of[last[drawn]]
+    return overlay.view(np.uint8).reshape(height, width, 4)
+
+
+def placement(module_count, style, scale=None):
+    """The ``Placement`` of a code with ``module_count`` modules a side in ``style``."""
+    if style.fit is not None:
+        module_size = (style.fit - 2 * FIT_BORDER) // (module_count + 2 * style.quiet_zone)
+        target_size = style.fit
+    else:
+        module_size = scale
+        target_size = (module_count + 2 * (style.quiet_zone + style.margin)) * module_size
+    content_size = module_count * module_size
+    origin = (target_size - content_size) // 2
+    if style.frame == "canvas":
+        frame_size, offset = target_size, 0
+    else:
+        frame_size = content_size + 2 * style.quiet_zone * module_size
+        offset = (target_size - frame_size) // 2
+    return Placement(module_size, origin, target_size, frame_size, offset)
+
+
+def style_matrix(url, style):
+    """
+    The QR matrix for ``url`` at the style's error correction level, as a boolean array.
+
+    Cached in the ``matrix`` layer of ``layer_cache.DEFAULT_CACHE``; the array is shared and must not be modified.
+    """
+    error = get_style(style).error
+    return DEFAULT_CACHE.get("matrix", (url, error),
+                             lambda: np.asarray(segno.make(url, error=error).matrix, dtype=bool))
+
+
+def _build_layout(matrix_key, style, scale):
+    count, packed = matrix_key
+    matrix = np.unpackbits(np.frombuffer(packed, dtype=np.uint8), count=count * count).reshape(count, count)
+    place = placement(count, style, scale)
+    geometry = module_geometry(matrix, style, place.module_size)
+    overlay = rasterize_geometry(geometry, (place.size, place.size), place.module_size, (place.origin, place.origin))
+    return OverlayLayout(
+        (place.size, place.size), (place.frame_size, place.frame_size), (place.offset, place.offset),
+        Image.fromarray(overlay, "RGBA"), style.base
+    )
+
+
+def style_layout(url, style, scale=None):
+    """
+    Size, frame placement and overlay of the QR code for ``url`` in ``style``.
+
+    The overlay depends only on the matrix, the style and the scale, and is
+    cached on them in the ``overlay`` layer of ``layer_cache.DEFAULT_CACHE``:
+    rendering the same code again skips the drawing. The returned overlay
+    is shared and must not be modified.
+
+    Args:
+        url: content of the QR code
+        style: a ``QRStyle`` or a name from ``STYLES``
+        scale: pixels per module, for styles without ``fit``
+    """
+    style = get_style(style)
+    matrix = style_matrix(url, style)
+    matrix_key = (len(matrix), np.packbits(matrix).tobytes())
+    key = (matrix_key, style, None if style.fit is not None else scale)
+    return DEFAULT_CACHE.get("overlay", key, partial(_build_layout, *key))
+
+
+# Frames composited together in one NumPy pass; bounds the memory a batch holds
+BATCH_FRAMES = 16
+
+# Filter of the frame resizes, Pillow's default for RGBA; cheaper ones only to meet a deadline
+RESAMPLE = Resampling.BICUBIC
+
+# Estimated cost of a frame, for renders with a deadline; see ``deadline.CostModel``
+RENDER_COST = CostModel(frame=0.001, source_pixel=48e-9, output_pixel=96e-9)
+
+
+class BatchCompositor:
+    """
+    Composite batches of background frames under a layout's overlay.
+
+    With ``overlay`` (GIF output) the frames of a batch are resized and
+    quantized into one (frames, height, width) array of palette indices,
+    placed on the base canvas in one assignment, and the overlay's lookup
+    table is applied to its visible pixels only, for the whole batch at once.
+    Without, frames are composited in full colour one by one with
+    ``Image.alpha_composite``, which is faster than the same blend in NumPy.
+
+    Args:
+        layout: an ``OverlayLayout``
+        overlay: the ``IndexedOverlay`` for GIF output, None for RGBA frames
+        resample: filter of the frame resizes
+    """
+
+    def __init__(self, layout, overlay=None, resample=RESAMPLE):
+        self.layout = layout
+        self.overlay = overlay
+        self.resample = resample
+        if overlay is not None:
+            # Fully transparent overlay pixels map every palette index to itself; skip them
+            self.visible = overlay.visible
+            self.classes = overlay.classes.ravel()[self.visible]
+            # No partial transparency in GIF: the base colour, opaque
+            self.base = overlay.palette.index(layout.base[:3])
+
+    def composite(self, indices):
+        """
+        Place a (frames, height, width) stack of palette indices at ``frame_size`` on the canvas and apply the overlay.
+
+        Returns the composited (frames, height, width) array; ``indices`` is left unchanged.
+        """
+        layout = self.layout
+        if layout.frame_size == layout.size:
+            canvas = indices.copy()
+        else:
+            width, height = layout.size
+            frame_width, frame_height = layout.frame_size
+            x, y = layout.offset
+            canvas = np.full((len(indices), height, width), self.base, dtype=np.uint8)
+            canvas[:, y:y + frame_height, x:x + frame_width] = indices
+        pixels = canvas.reshape(len(canvas), -1)
+        pixels[:, self.visible] = self.overlay.lut[self.classes, pixels[:, self.visible]]
+        return canvas
+
+    def _compose_rgba(self, frame):
+        layout = self.layout
+        with metrics.span("composite"):
+            if layout.frame_size == layout.size:
+                base = frame
+            else:
+                base = Image.new("RGBA", layout.size, layout.base)
+                base.paste(frame, layout.offset)
+            return Image.alpha_composite(base, layout.overlay)
+
+    def __call__(self, frames):
+        """Composite a list of background frames; returns the output frames, ``P`` images with ``overlay``."""
+        resized = []
+        for frame in frames:
+            with metrics.span("resize"):
+                # Quantizing only needs the colours of opaque frames, and RGB resizes faster than RGBA
+                mode = "RGB" if self.overlay is not None and is_opaque(frame) else "RGBA"
+                resized.append(frame.convert(mode).resize(self.layout.frame_size, self.resample))
+        if self.overlay is None:
+            return [self._compose_rgba(frame) for frame in resized]
+        palette = self.overlay.palette
+        with metrics.span("quantize"):
+            indices = np.stack([palette.quantize(frame) for frame in resized])
+        with metrics.span("composite"):
+            canvas = self.composite(indices)
+        return [palette.to_image(frame) for frame in canvas]
+
+
+def _resized_frames(decoded, size, duplicate_threshold, max_fps, resample):
+    # The frames of the streaming path, kept: shrunk, retimed, then resized
+    timed = ((shrink_frame(frame, size), duration or DEFAULT_DURATION)
+             for frame, duration in zip(decoded.frames, decoded.durations))
+    frames = []
+    for frame, duration in retime_frames(timed, duplicate_threshold, max_fps):
+        with metrics.span("resize"):
+            frames.append((frame.convert("RGBA").resize(size, resample), duration))
+    return frames
+
+
+def _cached_frames(cache, layout, background_image, bg, output_format, duplicate_threshold, max_fps, resample):
+    """
+    (frames, palette bytes) of a render, from the layers of ``cache``.
+
+    ``frames`` is the background decoded once, ``resized`` the retimed
+    frames at the layout's frame size, and for GIF ``palette`` and
+    ``indices`` their palette and palette indices; only the overlay is
+    composited again for a new style or URL of the same size.
+    """
+    size = layout.frame_size
+    source = background_key(background_image)
+    with metrics.span("decode"):
+        decoded = decoded_frames(cache, source, bg)
+    key = (source, size, duplicate_threshold, max_fps, resample)
+    resized = cache.get("resized", key, partial(_resized_frames, decoded, size, duplicate_threshold, max_fps,
+                                                resample))
+    durations = [duration for _, duration in resized]
+    if output_format.pillow_format != "GIF":
+        frames = map_timed_batches(BatchCompositor(layout, resample=resample), resized, BATCH_FRAMES)
+        return frames, None
+
+    def build_indices():
+        with metrics.span("quantize"):
+            return np.stack([palette.quantize(frame) for frame, _ in resized])
+
+    with metrics.span("palette"):
+        palette = cache.get("palette", (source, size, resample), lambda: build_palette(
+            shrink_frame(decoded.frames[i], size).convert("RGBA").resize(size, resample)
+            for i in sample_indices(len(decoded.frames))
+        ))
+    indices = cache.get("indices", key, build_indices)
+    compositor = BatchCompositor(layout, IndexedOverlay(layout.overlay, palette))
+
+    def frames():
+        for start in range(0, len(indices), BATCH_FRAMES):
+            with metrics.span("composite"):
+                canvas = compositor.composite(indices[start:start + BATCH_FRAMES])
+            for frame, duration in zip(canvas, durations[start:start + BATCH_FRAMES]):
+                yield palette.to_image(frame), duration
+
+    return frames(), palette.palette_bytes()
+
+
+def render_styled_gif(layout, output_filename, background_image, workers=1,
+                      duplicate_threshold=DUPLICATE_THRESHOLD, max_fps=None, limits=DEFAULT_LIMITS,
+                      output_format="gif", cache=None, resample=RESAMPLE, deadline=None):
+    """
+    Render an animated QR code: every background frame under the layout's overlay.
+
+    GIF output is composited on palette indices, against one palette for
+    the whole animation; WebP and APNG output is composited in full colour,
+    without building a palette.
+
+    With a ``cache``, the decoded, resized and quantized frames are kept in
+    it, so rendering the same background again, in another style, opacity
+    or URL, only composites the overlay; backgrounds too large for the
+    cache are streamed as without one. GIF frames are encoded over
+    ``workers`` processes either way; compositing only without a cache.
+
+    Args:
+        layout: an ``OverlayLayout``, e.g. from ``style_layout``
+        output_filename: filename or binary file object for the animation
+        background_image: path or file object of the background animation
+        workers: number of worker processes for compositing (see ``frame_pool.map_frames``)
+            and encoding (see ``gif_writer.GifWriter``); in parallel, frames are decoded once
+            into a ``frame_store.FrameStore`` the workers share
+        duplicate_threshold, max_fps: see ``timing.retime_frames``
+        limits: ``ingest.IngestLimits`` checked before decoding, None for no limits
+        output_format: an ``output_formats.OutputFormat`` or a name from ``output_formats.FORMATS``
+        cache: a ``layer_cache.LayerCache`` for the intermediate frames, None to keep none
+        resample: filter of the frame resizes
+        deadline: a ``deadline.Deadline``; frames stop, and the animation is
+            closed, once the next one would not finish in time
+
+    Raises:
+        ingest.IngestError: when the background is over ``limits``
+    """
+    output_format = get_format(output_format)
+    bg = open_background(background_image, limits)
+    size = layout.frame_size
+    workers = resolve_workers(workers)
+    frame_count = getattr(bg, "n_frames", 1)
+    if frame_count < MIN_PARALLEL_FRAMES:
+        workers = 1
+
+    if cache is not None and fits_decoded(cache, bg):
+        frames, palette_bytes = _cached_frames(cache, layout, background_image, bg, output_format,
+                                               duplicate_threshold, max_fps, resample)
+        if deadline is not None:
+            frames = deadline.frames(frames, BATCH_FRAMES)
+        with open_writer(output_filename, output_format, loop=0, palette=palette_bytes, workers=workers) as writer:
+            for combined, duration in frames:
+                writer.write(combined, duration)
+        return
+
+    if output_format.pillow_format == "GIF":
+        # One palette for the whole animation, with exact black and white for the modules
+        with metrics.span("palette"):
+            palette = build_palette(shrink_frame(frame, size).convert("RGBA").resize(size, resample)
+                                    for frame in sample_frames(bg))
+        compose = BatchCompositor(layout, IndexedOverlay(layout.overlay, palette), resample)
+        palette_bytes = palette.palette_bytes()
+    else:
+        compose = BatchCompositor(layout, resample=resample)
+        palette_bytes = None
+    store = None
+    if workers > 1:
+        # Decode once into shared memory; workers read their frames there and only get batches of indices
+        with metrics.span("decode"):
+            store, durations = decode_frames(bg, shrink_to=size)
+        timed = retime_frames(enumerate(durations), duplicate_threshold, max_fps,
+                              rgba=lambda index: store.frames[index])
+        compose = partial(apply_stored, compose, store.ref)
+    else:
+        # Keep the source frame timing, skipping frames that would look the same; big frames shrink as they load
+        timed = retime_frames(metrics.timed_iter(iter_timed_frames(bg, shrink_to=size), "decode"),
+                              duplicate_threshold, max_fps)
+    try:
+        # Composite a batch of frames at a time, streaming them into the writer
+        frames = map_timed_batches(compose, timed, BATCH_FRAMES, workers=workers, frame_count=frame_count)
+        if deadline is not None:
+            frames = deadline.frames(frames, BATCH_FRAMES)
+        with open_writer(output_filename, output_format, loop=0, palette=palette_bytes, workers=workers) as writer:
+            for combined, duration in frames:
+                writer.write(combined, duration)
+    finally:
+        if store is not None:
+            store.close()
+
+
+def tune_style(url, background_image, style, scale=None, min_contrast=preflight.MIN_CONTRAST, frames=None):
+    """
+    ``style`` with the lightest dot opacities that keep ``min_contrast`` on every frame of the background.
+
+    Only the module centres of each frame are sampled, so this costs about
+    one decode of the background; ``frames`` limits the frames checked (1
+    for still renders). A style without semi-transparent dots is refused
+    (see ``preflight.tunable``).
+
+    Returns:
+        (style, report): the tuned style and the ``preflight.ScanReport`` of the choice
+    """
+    style = get_style(style)
+    with metrics.span("preflight"):
+        matrix = style_matrix(url, style)
+        report = preflight.check(background_image, matrix, style, placement(len(matrix), style, scale),
+                                 min_contrast, frames=frames)
+    metrics.count("preflight_frames_below_target", int((report.contrast < min_contrast).sum()))
+    return preflight.tuned_style(style, report), report
+
+
+def plan_styled(deadline, url, style, scale, background_image, max_fps=None):
+    """
+    (style, scale, max_fps, resample) of a styled render, degraded to meet ``deadline``.
+
+    Lower scales are smaller modules: a smaller ``scale``, or a smaller
+    ``fit`` for styles fitted to a size.
+    """
+    style = get_style(style)
+    count = len(style_matrix(url, style))
+
+    def sized(module_size):
+        # The style and scale that give modules of ``module_size`` pixels
+        if style.fit is None:
+            return style, module_size
+        return style._replace(fit=module_size * (count + 2 * style.quiet_zone) + 2 * FIT_BORDER), scale
+
+    def output_pixels(module_size):
+        sized_style, sized_scale = sized(module_size)
+        return placement(count, sized_style, sized_scale).size ** 2
+
+    with Image.open(background_image) as image:
+        cost_of = partial(estimate, RENDER_COST, frame_count=getattr(image, "n_frames", 1),
+                          frame_duration=image.info.get("duration") or DEFAULT_DURATION,
+                          source_pixels=image.width * image.height, output_pixels=output_pixels)
+    if hasattr(background_image, "seek"):
+        background_image.seek(0)
+    module_size = placement(count, style, scale).module_size
+    plan = deadline.plan(RenderPlan(max_fps, module_size, RESAMPLE), cost_of, scale_steps(module_size))
+    style, scale = sized(plan.scale)
+    return style, scale, plan.max_fps, plan.resample
+
+
+def create_styled_gif(url, output_filename, background_image, style, scale=None, workers=1,
+                      duplicate_threshold=DUPLICATE_THRESHOLD, max_fps=None, output_format="gif",
+                      min_contrast=None, cache=None, deadline=None):
+    """
+    Render the QR code for ``url`` in ``style`` over an animated background.
+
+    Prints the outcome and returns False on errors, like the scripts built on it.
+    With ``min_contrast``, the dot opacities of ``style`` are first replaced
+    by the lightest that keep that contrast on every background frame (see
+    ``preflight.check``), and the choice is printed; a style with only solid
+    dots has nothing to tune and is refused. With a ``deadline``, the frame rate, module size
+    and resize filter are first degraded to fit it (see ``plan_styled``),
+    and the degradations are printed.
+
+    Args:
+        url: content of the QR code
+        output_filename: filename for the animation
+        background_image: path of the background animation
+        style: a ``QRStyle`` or a name from ``STYLES``
+        scale: pixels per module, for styles without ``fit``
+        workers, duplicate_threshold, max_fps, output_format, cache: see ``render_styled_gif``
+        min_contrast: target contrast (0-1, ``preflight.MIN_CONTRAST`` is grade C), or None to keep ``style``
+        deadline: a ``deadline.Deadline``, None to render in full however long it takes
+    """
+    try:
+        resample = RESAMPLE
+        if deadline is not None:
+            style, scale, max_fps, resample = plan_styled(deadline, url, style, scale, background_image, max_fps)
+        if min_contrast is not None:
+            style, report = tune_style(url, background_image, style, scale, min_contrast)
+            print(f"Pre-flight: {preflight.summary(report)}")
+        with metrics.span("layout"):
+            layout = style_layout(url, style, scale)
+        render_styled_gif(layout, output_filename, background_image, workers, duplicate_threshold, max_fps,
+                          output_format=output_format, cache=cache, resample=resample, deadline=deadline)
+        print(f"QR code saved as {output_filename}")
+        if deadline is not None and deadline.degradations:
+            print(f"Degraded to meet the deadline: {deadline.summary()}")
+        return True
+
+    except Exception as e:
+        print(f"Error creating QR code: {e}")
+        return False
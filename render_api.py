@@ -0,0 +1,320 @@
+import asyncio
+import io
+import os
+import tempfile
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+import segno
+import uvicorn
+from starlette.applications import Starlette
+from starlette.exceptions import HTTPException
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+import metrics
+from artistic_qr import write_artistic_animation
+from deadline import Deadline
+from ingest import DEFAULT_LIMITS, IngestError, check_limits, check_size, probe
+from layer_cache import LayerCache
+from output_formats import get_format
+from qr_style import RESAMPLE, STYLES, plan_styled, render_styled_gif, style_layout
+from result_cache import RENDERER_VERSION, ResultCache, cache_key
+from timing import DUPLICATE_THRESHOLD
+
+# Settings of the service, read by ``config_from_env``. ``workers`` renders
+# run at once in worker processes and ``max_pending`` more may wait for
+# one; request bodies over ``max_body_bytes`` are refused. Renders are
+# degraded to finish within ``render_timeout`` seconds of the request, and
+# one that still runs past it gets a 504.
+ApiConfig = namedtuple("ApiConfig", "workers max_pending max_body_bytes render_timeout cache_dir")
+
+DEFAULT_CONFIG = ApiConfig(
+    workers=2,
+    max_pending=8,
+    max_body_bytes=DEFAULT_LIMITS.max_bytes,
+    render_timeout=120,
+    cache_dir=os.path.join(tempfile.gettempdir(), "qrcode_animado_api"),
+)
+
+# Styles a request may ask for: the app's artistic code or a ``qr_style`` preset
+RENDER_STYLES = ("artistic",) + tuple(STYLES)
+
+# Share of ``render_timeout`` a render plans for; the rest brings the result back before the 504
+RENDER_BUDGET = 0.9
+
+# Pixels per module a request may ask for, and the default per style
+MAX_SCALE = 30
+DEFAULT_SCALE = {"artistic": 6}
+DEFAULT_STYLE_SCALE = 10
+
+
+def config_from_env(environ=None):
+    """
+    An ``ApiConfig`` from environment variables, ``DEFAULT_CONFIG`` for those unset.
+
+    ``QR_API_WORKERS``, ``QR_API_MAX_PENDING``, ``QR_API_MAX_BODY`` (bytes),
+    ``QR_API_TIMEOUT`` (seconds) and ``QR_API_CACHE_DIR``.
+    """
+    environ = os.environ if environ is None else environ
+    return ApiConfig(
+        workers=int(environ.get("QR_API_WORKERS", DEFAULT_CONFIG.workers)),
+        max_pending=int(environ.get("QR_API_MAX_PENDING", DEFAULT_CONFIG.max_pending)),
+        max_body_bytes=int(environ.get("QR_API_MAX_BODY", DEFAULT_CONFIG.max_body_bytes)),
+        render_timeout=float(environ.get("QR_API_TIMEOUT", DEFAULT_CONFIG.render_timeout)),
+        cache_dir=environ.get("QR_API_CACHE_DIR", DEFAULT_CONFIG.cache_dir),
+    )
+
+
+# Decoded and resized backgrounds kept by each worker process, for repeated renders over one background
+LAYER_CACHE_BYTES = 256 * 1024 * 1024
+_layer_cache = None
+
+
+def layer_cache():
+    """The ``LayerCache`` of this process, created on first use."""
+    global _layer_cache
+    if _layer_cache is None:
+        _layer_cache = LayerCache(max_bytes=LAYER_CACHE_BYTES)
+    return _layer_cache
+
+
+def render(url, background, style="artistic", scale=None, output_format="gif", finish_by=None):
+    """
+    Render one QR code over ``background`` (bytes); runs in a worker process.
+
+    Args:
+        url: content of the QR code
+        background: bytes of the background animation
+        style: "artistic" for the app's code, or a name from ``qr_style.STYLES``
+        scale: pixels per module, None for the style's default
+        output_format: a name from ``output_formats.FORMATS``
+        finish_by: ``time.time()`` by which the render must be done,
+            degrading it if needed (see ``deadline.Deadline``); None for no limit
+
+    Returns:
+        (the encoded animation as bytes, list of ``deadline.Degradation``)
+    """
+    output = io.BytesIO()
+    deadline = Deadline(finish_by - time.time()) if finish_by is not None else None
+    if style == "artistic":
+        write_artistic_animation(
+            segno.make(url, error='h'),
+            io.BytesIO(background),
+            output,
+            output_format=output_format,
+            deadline=deadline,
+            duplicate_threshold=DUPLICATE_THRESHOLD,
+            limits=DEFAULT_LIMITS,
+            cache=layer_cache(),
+            scale=scale or DEFAULT_SCALE["artistic"],
+        )
+    else:
+        scale, max_fps, resample = scale or DEFAULT_STYLE_SCALE, None, RESAMPLE
+        if deadline is not None:
+            style, scale, max_fps, resample = plan_styled(deadline, url, style, scale, io.BytesIO(background))
+        layout = style_layout(url, style, scale)
+        render_styled_gif(layout, output, io.BytesIO(background), max_fps=max_fps, output_format=output_format,
+                          cache=layer_cache(), resample=resample, deadline=deadline)
+    return output.getvalue(), deadline.degradations if deadline is not None else []
+
+
+async def read_body(request, limit):
+    """The request body, refused with 413 past ``limit`` bytes before it is all read."""
+    length = request.headers.get("content-length")
+    if length is not None and not length.isdigit():
+        raise HTTPException(400, f"Invalid Content-Length {length!r}")
+    if length is not None and int(length) > limit:
+        raise HTTPException(413, f"Body is {length} bytes, the limit is {limit}")
+    chunks = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > limit:
+            raise HTTPException(413, f"Body is over the limit of {limit} bytes")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def check_background(background):
+    """The ``BackgroundInfo`` of background bytes; 413 when over the ingest limits, 400 when unreadable."""
+    try:
+        check_size(len(background), DEFAULT_LIMITS.max_bytes)
+    except IngestError as e:
+        raise HTTPException(413, str(e))
+    try:
+        info = probe(io.BytesIO(background))
+    except IngestError as e:
+        raise HTTPException(400, str(e))
+    try:
+        check_limits(info, DEFAULT_LIMITS)
+    except IngestError as e:
+        raise HTTPException(413, str(e))
+    return info
+
+
+def render_params(query):
+    """(url, style, scale, output format) from the query string; 400 when invalid."""
+    url = query.get("url")
+    if not url:
+        raise HTTPException(400, "Missing url")
+    style = query.get("style", "artistic")
+    if style not in RENDER_STYLES:
+        raise HTTPException(400, f"Unknown style {style!r}, expected one of {', '.join(RENDER_STYLES)}")
+    scale = query.get("scale")
+    if scale is not None:
+        if not scale.isdigit() or not 1 <= int(scale) <= MAX_SCALE:
+            raise HTTPException(400, f"scale must be an integer from 1 to {MAX_SCALE}")
+        scale = int(scale)
+    try:
+        output_format = get_format(query.get("format", "gif"))
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    return url, style, scale, output_format
+
+
+async def upload_background(request):
+    """POST /backgrounds: keep a background for later renders; the body is the image."""
+    state = request.app.state
+    background = await read_body(request, state.config.max_body_bytes)
+    info = check_background(background)
+    key = cache_key(background)
+    state.backgrounds.put(key, background)
+    return JSONResponse({"background": key, "format": info.format, "width": info.width,
+                         "height": info.height, "frames": info.frames}, status_code=201)
+
+
+async def render_qr(request):
+    """
+    POST or GET /render: the QR code over the body, or over a kept background.
+
+    Query parameters: ``url`` (required), ``style``, ``scale``, ``format``,
+    and ``background``, the id returned by ``POST /backgrounds``, when the
+    body is empty. A render degraded to finish in time lists what it gave
+    up in the ``X-Degraded`` header, and is not cached.
+    """
+    state = request.app.state
+    config = state.config
+    url, style, scale, output_format = render_params(request.query_params)
+    background = await read_body(request, config.max_body_bytes) if request.method == "POST" else b""
+    if background:
+        check_background(background)
+    elif request.query_params.get("background"):
+        background = state.backgrounds.get(request.query_params["background"])
+        if background is None:
+            raise HTTPException(404, "Unknown background; upload it again")
+    else:
+        raise HTTPException(400, "Send the background as the body or its id as ?background=")
+
+    key = cache_key(background, url, style, scale, output_format, RENDERER_VERSION)
+    headers = {"Content-Disposition": f'inline; filename="qr_code{output_format.extension}"'}
+    data = state.results.get(key)
+    if data is not None:
+        return Response(data, media_type=output_format.mime, headers={**headers, "X-Cache": "hit"})
+
+    if state.pending >= config.workers + config.max_pending:
+        raise HTTPException(503, "Too many renders in progress", headers={"Retry-After": "5"})
+    with metrics.job(f"api_{style}", format=output_format.name):
+        # The time waiting for a worker counts: the client's timeout runs from now
+        finish_by = time.time() + config.render_timeout * RENDER_BUDGET
+        future = submit_render(state, url, background, style, scale, output_format.name, finish_by)
+        try:
+            data, degradations = await asyncio.wait_for(asyncio.wrap_future(future), config.render_timeout)
+        except asyncio.TimeoutError:
+            # Only a render still waiting for a worker is cancelled; a running one keeps its worker until it ends
+            future.cancel()
+            raise HTTPException(504, f"Render took more than {config.render_timeout:g} s")
+        except ValueError as e:
+            # Bad input found while rendering, e.g. a URL too long for a QR code
+            raise HTTPException(400, str(e))
+        metrics.count("bytes_out", len(data))
+    if degradations:
+        # Not kept: the same request may get the full render when the service is less busy
+        headers["X-Degraded"] = "; ".join(f"{step} ({detail})" for step, detail in degradations)
+    else:
+        state.results.put(key, data)
+    return Response(data, media_type=output_format.mime, headers={**headers, "X-Cache": "miss"})
+
+
+def submit_render(state, *args):
+    """
+    Submit a ``render`` to the worker pool, counted in ``state.pending`` until it ends.
+
+    The count drops when the work itself ends, not when the request does: a
+    render that timed out still runs in its worker process, and admission
+    control must not let in more work than the pool can run.
+    """
+    loop = asyncio.get_running_loop()
+
+    def release(_):
+        loop.call_soon_threadsafe(_release, state)
+
+    state.pending += 1
+    try:
+        future = state.pool.submit(render, *args)
+    except BaseException:
+        state.pending -= 1
+        raise
+    future.add_done_callback(release)
+    return future
+
+
+def _release(state):
+    state.pending -= 1
+
+
+async def health(request):
+    """GET /healthz: liveness, with the renders in progress."""
+    state = request.app.state
+    return JSONResponse({"status": "ok", "pending": state.pending, "workers": state.config.workers})
+
+
+async def prometheus(request):
+    """GET /metrics: the Prometheus text of ``metrics.REGISTRY`` (request latency and errors)."""
+    if not metrics.is_enabled():
+        raise HTTPException(404, "Metrics are off; set QR_METRICS=1")
+    return Response(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def create_app(config=None):
+    """
+    The render service, as an ASGI application.
+
+    Requests are handled on one asyncio event loop; renders run on a pool
+    of ``config.workers`` processes, so a slow render never blocks the
+    loop and CPU use stays bounded per instance. Results and uploaded
+    backgrounds are kept in ``ResultCache``s under ``config.cache_dir``.
+
+    Args:
+        config: an ``ApiConfig``, None to read it from the environment
+    """
+    config = config_from_env() if config is None else config
+
+    @asynccontextmanager
+    async def lifespan(app):
+        app.state.pool = ProcessPoolExecutor(max_workers=config.workers)
+        try:
+            yield
+        finally:
+            app.state.pool.shutdown(wait=False, cancel_futures=True)
+
+    app = Starlette(
+        routes=[
+            Route("/backgrounds", upload_background, methods=["POST"]),
+            Route("/render", render_qr, methods=["GET", "POST"]),
+            Route("/healthz", health, methods=["GET"]),
+            Route("/metrics", prometheus, methods=["GET"]),
+        ],
+        lifespan=lifespan,
+    )
+    app.state.config = config
+    app.state.pending = 0
+    app.state.backgrounds = ResultCache(directory=os.path.join(config.cache_dir, "backgrounds"))
+    app.state.results = ResultCache(directory=os.path.join(config.cache_dir, "results"))
+    return app
+
+
+if __name__ == "__main__":
+    # Heroku gives the port in $PORT; QR_METRICS=1 adds request metrics on /metrics
+    metrics.configure_from_env()
+    uvicorn.run(create_app(), host=os.environ.get("HOST", "0.0.0.0"), port=int(os.environ.get("PORT", 8000)))
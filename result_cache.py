@@ -0,0 +1,177 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+import qrcode_artistic
+import segno
+
+# Bump when the look of the generated QR codes changes, to invalidate cached results
+STYLE_VERSION = 3
+RENDERER_VERSION = f"segno-{segno.__version__}/qrcode-artistic-{qrcode_artistic.__version__}/style-{STYLE_VERSION}"
+
+
+def cache_key(*parts):
+    """
+    Content hash of the inputs of a render.
+
+    Bytes are hashed as-is, everything else by its ``repr``, each part
+    length-prefixed so that different splits of the same data never collide.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        if not isinstance(part, (bytes, bytearray, memoryview)):
+            part = repr(part).encode("utf-8")
+        digest.update(len(part).to_bytes(8, "little"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Two-tier cache of finished renders, keyed by ``cache_key``.
+
+    The memory tier is an LRU bounded by total bytes. The optional disk tier
+    keeps one file per key, is bounded by total bytes as well, and evicts
+    the least recently used files first (recency is tracked in the file
+    access time, creation in the modification time). Entries older than
+    ``ttl`` seconds are dropped from both tiers. Safe to share between
+    threads.
+
+    Args:
+        directory: folder for the disk tier, None for memory only
+        max_memory_bytes: size limit of the memory tier
+        max_disk_bytes: size limit of the disk tier
+        ttl: lifetime of an entry in seconds, None for no expiry
+    """
+
+    def __init__(self, directory=None, max_memory_bytes=64 * 1024 * 1024,
+                 max_disk_bytes=512 * 1024 * 1024, ttl=24 * 60 * 60):
+        self.directory = directory
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl = ttl
+        self._memory = OrderedDict()  # key -> (created, data)
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _expired(self, created, now):
+        return self.ttl is not None and now - created > self.ttl
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".bin")
+
+    def get(self, key):
+        """Return the cached bytes for ``key``, or None."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if self._expired(entry[0], now):
+                    self._discard(key)
+                    entry = None
+                else:
+                    self._memory.move_to_end(key)
+        if entry is not None:
+            created, data = entry
+            self._touch(key, now, created)
+            return data
+
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            created = os.path.getmtime(path)
+            if self._expired(created, now):
+                os.remove(path)
+                return None
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        self._touch(key, now, created)
+        with self._lock:
+            self._store(key, created, data)
+        return data
+
+    def _touch(self, key, now, created):
+        # Mark the disk entry as recently used without changing its creation time
+        if self.directory:
+            try:
+                os.utime(self._path(key), (now, created))
+            except OSError:
+                pass
+
+    def put(self, key, data):
+        """Store ``data`` (bytes) under ``key`` in both tiers."""
+        data = bytes(data)
+        now = time.time()
+        with self._lock:
+            self._store(key, now, data)
+        if self.directory and len(data) <= self.max_disk_bytes:
+            path = self._path(key)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except OSError:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                return
+            self._evict_disk(now)
+
+    def _discard(self, key):
+        _, data = self._memory.pop(key)
+        self._memory_bytes -= len(data)
+
+    def _store(self, key, created, data):
+        if key in self._memory:
+            self._discard(key)
+        if len(data) > self.max_memory_bytes:
+            return
+        self._memory[key] = (created, data)
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.max_memory_bytes:
+            self._discard(next(iter(self._memory)))
+
+    def _evict_disk(self, now):
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".bin"):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            if self._expired(stat.st_mtime, now):
+                self._remove(entry.path)
+                continue
+            entries.append((stat.st_atime, stat.st_size, entry.path))
+            total += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_disk_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def clear(self):
+        """Drop every entry from both tiers."""
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+        if self.directory:
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(".bin"):
+                    self._remove(entry.path)
@@ -0,0 +1,41 @@
+import pytest
+
+import benchmark
+from check_memory import BUDGETS, QUICK_FRAMES, check_budgets, frame_growth, measure_in_child
+
+# The peak RSS one quick render may add, in MB: tighter than the sweep's
+# budget, with headroom over the 29 MB basic adds at 96 frames
+PEAK_RSS_MB = 48
+
+
+def result(renderer, frames, rss_peak, error_message=None):
+    return {"renderer": renderer, "background": {"frames": frames, "width": 160, "height": 160},
+            "rss_peak": rss_peak, "traced_peak": 0, "error_message": error_message}
+
+
+def test_check_budgets_flags_runs_over_budget():
+    mb = 1024 * 1024
+    results = [result("styled", 16, 10 * mb), result("styled", 32, 20 * mb), result("basic", 16, 100 * mb)]
+    failures, flags, growth = check_budgets(results)
+    assert failures == [
+        "basic 16f 160x160: peak RSS +100.0 MB, budget 80 MB",
+        "styled 160x160: +640 KB per background frame, budget 256 KB",
+    ]
+    assert flags == ["styled 160x160: +640 KB per background frame, peak scales 1.00 with the frame count "
+                     "(linear in frames)"]
+    assert growth == {("styled", 160, 160): (10 * mb / 16, 1.0)}
+
+
+@pytest.mark.parametrize("renderer", ["basic", "styled"])
+def test_streaming_renderer_peak_rss(renderer, tmp_path):
+    url = benchmark.make_url(40)
+    results = []
+    for frames in QUICK_FRAMES:
+        background = str(tmp_path / f"bg_{frames}.gif")
+        benchmark.synthetic_background(background, frames, (160, 160))
+        rss_peak, failure = measure_in_child(renderer, url, background, 8, "h", str(tmp_path / "out.gif"))
+        assert failure is None
+        assert rss_peak <= PEAK_RSS_MB * 1024 * 1024
+        results.append(result(renderer, frames, rss_peak))
+    per_frame, _ = frame_growth(results)
+    assert per_frame <= BUDGETS[renderer].per_frame * 1024
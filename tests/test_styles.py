@@ -0,0 +1,146 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+import segno
+from PIL import Image, ImageDraw, ImageSequence
+
+from pil_qr_creator import create_qr_with_pil
+from qr_style import BatchCompositor, style_layout
+
+URL = 'https://www.sicredi.com.br/coop/grandesrios/assembleias-2025/'
+BACKGROUND = Path(__file__).resolve().parent.parent / 'sicre.gif'
+FRAMES = 3
+
+
+def is_finder(x, y, count):
+    return (x < 7 and y < 7) or (x < 7 and y >= count - 7) or (x >= count - 7 and y < 7)
+
+
+def original_styled_frame(url, frame, error='h', finder_halo=2, dot_padding=0.3, base=(255, 255, 255, 255)):
+    """
+    One frame of the original working_qr.create_styled_qr, drawn module by module.
+
+    With ``error='m'``, ``finder_halo=3``, ``dot_padding=0.35`` and a base
+    alpha of 220 it is the original pil_qr_creator.create_styled_qr.
+    """
+    matrix = segno.make(url, error=error).matrix
+    target_size = 300
+    module_size = (target_size - 20) // (len(matrix) + 4)
+    quiet_zone = 2
+    qr_size = len(matrix) * module_size + 2 * quiet_zone * module_size
+
+    canvas = Image.new("RGBA", (target_size, target_size), base)
+    frame = frame.convert("RGBA").resize((qr_size, qr_size))
+    x_offset = y_offset = (target_size - qr_size) // 2
+    canvas.paste(frame, (x_offset, y_offset))
+
+    overlay = Image.new("RGBA", canvas.size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(overlay)
+    for y, row in enumerate(matrix):
+        for x, cell in enumerate(row):
+            if not cell:
+                continue
+            pos_x = (x + quiet_zone) * module_size + x_offset
+            pos_y = (y + quiet_zone) * module_size + y_offset
+            if is_finder(x, y, len(matrix)):
+                draw.rectangle([pos_x - finder_halo, pos_y - finder_halo,
+                                pos_x + module_size + finder_halo, pos_y + module_size + finder_halo],
+                               fill=(255, 255, 255, 255))
+                draw.rectangle([pos_x, pos_y, pos_x + module_size, pos_y + module_size], fill=(0, 0, 0, 255))
+            else:
+                padding = int(module_size * dot_padding)
+                draw.rectangle([pos_x + padding - 1, pos_y + padding - 1,
+                                pos_x + module_size - padding + 1, pos_y + module_size - padding + 1],
+                               fill=(255, 255, 255, 255))
+                draw.rectangle([pos_x + padding, pos_y + padding,
+                                pos_x + module_size - padding, pos_y + module_size - padding],
+                               fill=(0, 0, 0, 255))
+    return Image.alpha_composite(canvas, overlay)
+
+
+def original_pil_frame(url, frame):
+    """One frame of the original pil_qr_creator.create_styled_qr."""
+    return original_styled_frame(url, frame, error='m', finder_halo=3, dot_padding=0.35,
+                                 base=(255, 255, 255, 220))
+
+
+def original_basic_frame(url, frame, scale=30):
+    """One frame of the original basic_qr.create_basic_qr."""
+    matrix = segno.make(url, error='h').matrix
+    module_size = scale
+    quiet_zone = 4
+    qr_content_size = len(matrix) * module_size
+    target_size = qr_content_size + 2 * quiet_zone * module_size + 4 * module_size
+
+    frame = frame.convert("RGBA").resize((target_size, target_size))
+    overlay = Image.new("RGBA", frame.size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(overlay)
+    offset = (target_size - qr_content_size) // 2
+    for y, row in enumerate(matrix):
+        for x, cell in enumerate(row):
+            pos_x = x * module_size + offset
+            pos_y = y * module_size + offset
+            if is_finder(x, y, len(matrix)):
+                draw.rectangle([pos_x - 4, pos_y - 4, pos_x + module_size + 4, pos_y + module_size + 4],
+                               fill=(255, 255, 255, 255))
+                draw.rectangle([pos_x, pos_y, pos_x + module_size, pos_y + module_size], fill=(0, 0, 0, 255))
+            else:
+                dot_size = int(module_size * 0.3)
+                margin = (module_size - dot_size) // 2
+                draw.rectangle([pos_x + margin, pos_y + margin, pos_x + margin + dot_size, pos_y + margin + dot_size],
+                               fill=(0, 0, 0, 255) if cell else (255, 255, 255, 30))
+    return Image.alpha_composite(frame, overlay)
+
+
+def original_static_image(url, background_image, scale=10, opacity=128):
+    """The image of the original pil_qr_creator.create_qr_with_pil."""
+    matrix = segno.make(url, error='h').matrix
+    module_size = scale
+    quiet_zone = 4
+    qr_size = len(matrix) * module_size + 2 * quiet_zone * module_size
+
+    with Image.open(background_image) as bg:
+        bg = bg.resize((qr_size, qr_size)).convert("RGBA")
+    overlay = Image.new("RGBA", bg.size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(overlay)
+    for y, row in enumerate(matrix):
+        for x, cell in enumerate(row):
+            if cell:
+                pos_x = (x + quiet_zone) * module_size
+                pos_y = (y + quiet_zone) * module_size
+                draw.rectangle([pos_x, pos_y, pos_x + module_size, pos_y + module_size], fill=(0, 0, 0, opacity))
+    return Image.alpha_composite(bg, overlay)
+
+
+def assert_same_pixels(actual, expected):
+    actual, expected = np.asarray(actual), np.asarray(expected)
+    assert actual.shape == expected.shape
+    differing = np.any(actual != expected, axis=-1)
+    ys, xs = np.nonzero(differing)
+    assert not len(ys), (f"{len(ys)} pixels differ, first at ({xs[0]}, {ys[0]}): "
+                         f"{actual[ys[0], xs[0]].tolist()}, expected {expected[ys[0], xs[0]].tolist()}")
+
+
+def background_frames(count=FRAMES):
+    with Image.open(BACKGROUND) as bg:
+        return [frame.copy() for _, frame in zip(range(count), ImageSequence.Iterator(bg))]
+
+
+@pytest.mark.parametrize("style, scale, original", [
+    ("styled", None, original_styled_frame),
+    ("pil", None, original_pil_frame),
+    ("basic", 30, original_basic_frame),
+])
+def test_animated_style_matches_original_renderer(style, scale, original):
+    compose = BatchCompositor(style_layout(URL, style, scale))
+    frames = background_frames()
+    for frame, actual in zip(frames, compose([frame.copy() for frame in frames])):
+        assert_same_pixels(actual, original(URL, frame))
+
+
+def test_static_style_matches_original_renderer(tmp_path):
+    output = tmp_path / "static.png"
+    assert create_qr_with_pil(URL, str(output), str(BACKGROUND))
+    with Image.open(output) as actual:
+        assert_same_pixels(actual.convert("RGBA"), original_static_image(URL, BACKGROUND))
@@ -0,0 +1,89 @@
+import math
+import numpy as np
+from PIL import ImageSequence
+import metrics
+from gif_writer import rgba_array
+from ingest import shrink_frame
+
+# Duration for frames whose source gives none, the value every renderer used to hard-code
+DEFAULT_DURATION = 50
+
+# Largest per-channel difference between two source frames still treated as the same frame
+DUPLICATE_THRESHOLD = 8
+
+
+def iter_timed_frames(image, default_duration=DEFAULT_DURATION, shrink_to=None):
+    """
+    Yield (frame, duration in milliseconds) for every frame of ``image``.
+
+    Frames are independent copies, safe to send to another process. A
+    missing or zero source duration is replaced by ``default_duration``.
+    With ``shrink_to`` (width, height), frames much larger than that are
+    shrunk as they are decoded (see ``ingest.shrink_frame``).
+    """
+    for frame in ImageSequence.Iterator(image):
+        copy = frame.copy() if shrink_to is None else shrink_frame(frame, shrink_to)
+        yield copy, frame.info.get("duration") or default_duration
+
+
+def frames_match(previous, current, threshold=DUPLICATE_THRESHOLD):
+    """
+    Whether two RGBA arrays differ by at most ``threshold`` in every channel.
+
+    Pixels transparent in both arrays match whatever their colour channels.
+    """
+    if previous.shape != current.shape:
+        return False
+    # |a - b| without leaving uint8
+    difference = np.maximum(previous, current) - np.minimum(previous, current)
+    hidden = (previous[..., 3] == 0) & (current[..., 3] == 0)
+    if hidden.any():
+        difference[hidden] = 0
+    return int(difference.max(initial=0)) <= threshold
+
+
+def retime_frames(timed_frames, threshold=DUPLICATE_THRESHOLD, max_fps=None, rgba=rgba_array):
+    """
+    Drop redundant source frames before they are rendered.
+
+    With ``max_fps`` the animation is resampled on a grid of ``1000 / max_fps``
+    ms: only the frame on screen at each grid time is kept, from that time
+    on. A frame that matches the last kept frame (see ``frames_match``) is
+    folded into it. Kept frames last until the next kept frame starts, so
+    the animation keeps its total length.
+
+    Args:
+        timed_frames: iterable of (frame, duration) pairs, e.g. ``iter_timed_frames``
+        threshold: see ``frames_match``; None keeps near-identical frames
+        max_fps: optional frame rate cap
+        rgba: callable giving the RGBA array of a frame, for frames that
+            are not images (e.g. indices into a ``frame_store.FrameStore``)
+
+    Yields:
+        (frame, duration) pairs
+    """
+    interval = 1000 / max_fps if max_fps else None
+    pending = None  # [frame, start time, RGBA array]
+    slot = 0  # Next grid time, in intervals
+    end = 0
+    for frame, duration in timed_frames:
+        start, end = end, end + duration
+        if interval is not None:
+            if pending is not None and slot * interval >= end:
+                continue  # Never on screen at a grid time
+            start = slot * interval
+            slot = max(slot + 1, math.ceil(end / interval - 1e-9))
+        array = None
+        if pending is not None and threshold is not None:
+            with metrics.span("dedupe"):
+                array = rgba(frame)
+                if pending[2] is None:
+                    pending[2] = rgba(pending[0])
+                match = frames_match(pending[2], array, threshold)
+            if match:
+                continue
+        if pending is not None:
+            yield pending[0], round(start) - round(pending[1])
+        pending = [frame, start, array]
+    if pending is not None:
+        yield pending[0], round(end) - round(pending[1])